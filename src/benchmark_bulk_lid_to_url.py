@@ -0,0 +1,131 @@
+import os
+import time
+import zlib
+import argparse
+from unittest import mock
+
+import numpy as np
+import requests
+
+from lid import LID
+from lid_to_url import lid_to_url
+from bulk_lid_to_url import bulk_lid_to_url
+
+
+def synthetic_lids(n: int, seed: int = 0) -> list[str]:
+    """
+    LIDs from each supported survey, in roughly equal numbers, with a few
+    invalid ones.
+    """
+    rng = np.random.default_rng(seed)
+    lids: list[str] = []
+    for i in range(n):
+        survey = rng.integers(5)
+        day = 1 + i % 28
+        if survey == 0:
+            lids.append(
+                "urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:"
+                f"g96_2021{1 + i % 12:02d}{day:02d}_2b_f5q9m2_01_{i % 10000:04d}.arch"
+            )
+        elif survey == 1:
+            lids.append(
+                "urn:nasa:pds:gbo.ast.spacewatch.survey:data:"
+                f"sw_0996_SW403s_2003_07_{day:02d}_08_40_33.{i % 1000:03d}.fits"
+            )
+        elif survey == 2:
+            collection, prefix = rng.choice(
+                [("data_geodss", "g"), ("data_tricam", "p")]
+            )
+            lids.append(
+                f"urn:nasa:pds:gbo.ast.neat.survey:{collection}:"
+                f"{prefix}200111{day:02d}_obsdata_200111{day:02d}{i % 1000000:06d}d"
+            )
+        elif survey == 3:
+            lids.append(
+                "urn:nasa:pds:gbo.ast.loneos.survey:data_augmented:"
+                f"0{4 + i % 2}11{day:02d}_1a_{i % 1000:03d}_fits"
+            )
+        else:
+            lids.append(f"urn:nasa:pds:gbo.ast.unknown.survey:data:{i}")
+    return lids
+
+
+def fake_head(latency: float):
+    """HTTP HEAD stand-in: waits, then reports every other file missing."""
+
+    def head(*args, **kwargs):
+        time.sleep(latency)
+        response = requests.Response()
+        response.status_code = 200 if zlib.crc32(args[-1].encode()) % 2 else 404
+        return response
+
+    return head
+
+
+def benchmark_bulk_lid_to_url(n: int, serial: int, latency: float, workers: int):
+    """
+    Print the throughput of `lid_to_url` in a loop, and `bulk_lid_to_url`.
+
+    With ``latency``, Catalina Sky Survey LIDs are checked for availability at
+    S3 against a simulated HTTP HEAD with that latency.
+    """
+    lids = synthetic_lids(n)
+    os.environ["S3_CSS_DATE_LIMIT"] = "20210630" if latency > 0 else "00000000"
+
+    with mock.patch("requests.head", fake_head(latency)), mock.patch(
+        "requests.Session.head", lambda self, *args, **kwargs: fake_head(latency)(*args)
+    ):
+        # the same information, one LID at a time
+        sample = lids[:serial]
+        loop_results = []
+        start = time.perf_counter()
+        for lid in sample:
+            try:
+                parsed = LID(lid)
+                loop_results.append(
+                    {
+                        "lid": str(parsed),
+                        "bundle": parsed.bundle,
+                        "collection": parsed.collection,
+                        "product_id": parsed.product_id,
+                        "url": lid_to_url(lid),
+                    }
+                )
+            except ValueError as e:
+                loop_results.append({"lid": lid, "error": str(e)})
+        loop = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = bulk_lid_to_url(lids, max_workers=workers)
+        bulk = time.perf_counter() - start
+
+    errors = sum("error" in result for result in results)
+    print(f"HEAD latency {latency * 1000:.0f} ms, {workers} concurrent checks")
+    print(
+        f"lid_to_url loop    {len(sample):>7} LIDs {loop:8.3f} s "
+        f"{len(sample) / loop:>10.0f} LIDs/s"
+    )
+    print(
+        f"bulk_lid_to_url    {len(lids):>7} LIDs {bulk:8.3f} s "
+        f"{len(lids) / bulk:>10.0f} LIDs/s ({errors} invalid)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bulk LID to URL.")
+    parser.add_argument("-n", type=int, default=100000, help="number of LIDs")
+    parser.add_argument(
+        "--serial", type=int, default=None, help="LIDs for the lid_to_url loop"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="simulated S3 HEAD latency, ms"
+    )
+    parser.add_argument("--workers", type=int, default=32, help="concurrent checks")
+    args = parser.parse_args()
+
+    serial = args.serial
+    if serial is None:
+        # keep the loop to a few seconds with simulated network checks
+        serial = args.n if args.latency == 0 else 200
+
+    benchmark_bulk_lid_to_url(args.n, serial, args.latency / 1000, args.workers)
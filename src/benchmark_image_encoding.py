@@ -0,0 +1,97 @@
+import io
+import time
+import argparse
+
+import numpy as np
+from PIL import Image
+from astropy.io import fits
+
+from sbn_sis import fits_to_image
+from image_encoder import EFFORT, QUALITY, encode_image, submit_encode
+
+
+def synthetic_cutout(size: int, seed: int = 0) -> fits.HDUList:
+    """
+    Sky background, read noise, and a sprinkling of stars, roughly like a
+    survey image cutout.
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.normal(2500, 30, (size, size))
+
+    y, x = np.mgrid[:size, :size]
+    for _ in range(size // 10):
+        x0, y0 = rng.uniform(0, size, 2)
+        flux = rng.lognormal(8, 1.5)
+        data += flux * np.exp(-((x - x0) ** 2 + (y - y0) ** 2) / (2 * 1.5**2))
+
+    return fits.HDUList([fits.PrimaryHDU(data.astype(np.float32))])
+
+
+def time_encode(image: Image.Image, image_format: str, repeat: int, **options):
+    """Best-of-repeat encode time and the encoded size."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        buffer = encode_image(image, image_format, **options)
+        best = min(best, time.perf_counter() - start)
+    return best, len(buffer.getvalue())
+
+
+def benchmark_image_encoding(sizes: list[int], repeat: int, threads: int):
+    """
+    Print encode time against bytes for each format and setting, and the
+    throughput of the shared encoder pool.
+    """
+    for size in sizes:
+        cutout = synthetic_cutout(size)
+        image = fits_to_image(cutout)
+        fits_buffer = io.BytesIO()
+        cutout.writeto(fits_buffer)
+
+        print(
+            f"\n{size} x {size} pixels, "
+            f"FITS (float32) {len(fits_buffer.getvalue())} bytes"
+        )
+        print(f"{'format':8} {'quality':>8} {'effort':>7} {'bytes':>10} {'ms':>9}")
+
+        settings = [("jpeg", {"quality": q}) for q in (75, 85, 95)]
+        settings += [("png", {"effort": e}) for e in (1, 3, 6, 9)]
+        settings += [
+            ("webp", {"quality": q, "effort": e}) for q in (75, 85) for e in (0, 2, 4, 6)
+        ]
+        for image_format, options in settings:
+            elapsed, nbytes = time_encode(image, image_format, repeat, **options)
+            print(
+                f"{image_format:8} {options.get('quality', ''):>8} "
+                f"{options.get('effort', ''):>7} {nbytes:>10} {elapsed * 1000:>9.1f}"
+            )
+
+        # encodes run concurrently only if the encoder releases the GIL
+        for image_format in sorted(QUALITY.keys() | EFFORT.keys()):
+            start = time.perf_counter()
+            for _ in range(threads):
+                encode_image(image, image_format)
+            serial = time.perf_counter() - start
+
+            start = time.perf_counter()
+            futures = [submit_encode(image, image_format) for _ in range(threads)]
+            for future in futures:
+                future.result()
+            pooled = time.perf_counter() - start
+
+            print(
+                f"{image_format}: {threads} encodes, serial {serial * 1000:.1f} ms, "
+                f"pooled {pooled * 1000:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cutout image encoding.")
+    parser.add_argument(
+        "--size", type=int, nargs="+", default=[300, 1200], help="cutout sizes, pixels"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="repeats per setting")
+    parser.add_argument("--threads", type=int, default=4, help="pooled encodes")
+    args = parser.parse_args()
+
+    benchmark_image_encoding(args.size, args.repeat, args.threads)
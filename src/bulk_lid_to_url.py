@@ -0,0 +1,176 @@
+from typing import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from lid import LID, InvalidLIDError
+from lid_to_url import (
+    PRODUCT_TO_URL,
+    UPSTREAM_TIMEOUT,
+    css_product_urls,
+    get_s3_css_date_limit,
+)
+
+# Seconds to wait for all S3 availability checks of a request.  Checks still
+# pending are treated as unavailable, i.e., their LIDs are given PSI URLs.
+BULK_CHECK_TIMEOUT: float = 20
+
+
+def bulk_lid_to_url(
+    lids: Iterable[LID | str],
+    max_workers: int = 32,
+    timeout: float = BULK_CHECK_TIMEOUT,
+) -> list[dict]:
+    """Convert many PDS4 LIDs to URLs.
+
+    Each LID is parsed once, and LIDs are resolved together by survey.  The
+    Catalina Sky Survey S3 availability checks (see `css_lid_to_url`) are run
+    concurrently, within an overall time limit.
+
+
+    Parameters
+    ----------
+    lids : iterable of LID or str
+        PDS4 LIDs.
+
+    max_workers : int, optional
+        Maximum number of concurrent availability checks.
+
+    timeout : float, optional
+        Seconds to wait for all availability checks.  LIDs not yet checked are
+        given PSI URLs.
+
+
+    Returns
+    -------
+    results : list of dict
+        For each LID, in order: ``lid``, ``bundle``, ``collection``,
+        ``product_id``, and ``url``; or ``lid`` and ``error`` if the LID is
+        invalid or not from a supported survey.
+
+    """
+
+    results: list[dict | None] = []
+
+    # collection and product ID of each LID, with the index of its result
+    by_bundle: dict[str, list[tuple[int, str, str, str]]] = {}
+
+    lid: LID | str
+    for lid in lids:
+        try:
+            parsed: LID = LID(lid)
+            by_bundle.setdefault(parsed.bundle, []).append(
+                (len(results), str(parsed), parsed.collection, parsed.product_id)
+            )
+            results.append(None)
+        except (InvalidLIDError, IndexError):
+            results.append({"lid": str(lid), "error": f"Invalid PDS4 LID: {lid}"})
+
+    # S3 URLs that need to be tested, and the index of their LIDs
+    aws_urls: list[tuple[int, str]] = []
+    s3_date_limit: str = get_s3_css_date_limit()
+
+    bundle: str
+    products: list[tuple[int, str, str, str]]
+    i: int
+    collection: str
+    product_id: str
+    url: str
+    for bundle, products in by_bundle.items():
+        to_url: Callable[[str, str], str] | None = PRODUCT_TO_URL.get(bundle)
+        for i, lid, collection, product_id in products:
+            try:
+                if bundle == "gbo.ast.catalina.survey":
+                    aws_url, url = css_product_urls(
+                        collection, product_id, s3_date_limit
+                    )
+                    if aws_url is not None:
+                        aws_urls.append((i, aws_url))
+                elif to_url is not None:
+                    url = to_url(collection, product_id)
+                else:
+                    raise KeyError(bundle)
+            except (KeyError, IndexError, ValueError):
+                results[i] = {
+                    "lid": lid,
+                    "error": f"Invalid or unsupported PDS4 LID: {lid}",
+                }
+                continue
+
+            results[i] = {
+                "lid": lid,
+                "bundle": bundle,
+                "collection": collection,
+                "product_id": product_id,
+                "url": url,
+            }
+
+    if len(aws_urls) > 0:
+        for (i, aws_url), available in zip(
+            aws_urls, urls_available([url for _, url in aws_urls], max_workers, timeout)
+        ):
+            if available:
+                results[i]["url"] = aws_url
+
+    return results
+
+
+def urls_available(
+    urls: list[str], max_workers: int = 32, timeout: float = BULK_CHECK_TIMEOUT
+) -> list[bool]:
+    """Test URLs for availability with concurrent HTTP HEAD requests.
+
+
+    Parameters
+    ----------
+    urls : list of str
+        URLs to test.
+
+    max_workers : int, optional
+        Maximum number of concurrent requests.
+
+    timeout : float, optional
+        Seconds to wait for all requests.  Requests not yet sent are cancelled,
+        and those still running are left to finish in the background.
+
+
+    Returns
+    -------
+    available : list of bool
+        `True` for each URL that responded with status code 200 within
+        `UPSTREAM_TIMEOUT` seconds, and before the overall ``timeout``.
+
+    """
+
+    workers: int = max(min(max_workers, len(urls)), 1)
+    session: requests.Session = requests.Session()
+    adapter: HTTPAdapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    def available(url: str) -> bool:
+        try:
+            return session.head(url, timeout=UPSTREAM_TIMEOUT).status_code == 200
+        except requests.RequestException:
+            return False
+
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers)
+    futures: list[Future] = [executor.submit(available, url) for url in urls]
+    done: set[Future]
+    done, _ = wait(futures, timeout=timeout)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    # close the session after the last running request
+    running: list[Future] = [future for future in futures if not future.done()]
+
+    def close(_: Future) -> None:
+        if all(future.done() for future in running):
+            session.close()
+
+    if len(running) == 0:
+        session.close()
+    for future in running:
+        future.add_done_callback(close)
+
+    return [future in done and future.result() for future in futures]
@@ -0,0 +1,105 @@
+from botocore.client import BaseClient
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from sbn_sis import cutout_bbox
+from lid_cache import (
+    MAX_ENTRIES_PER_LID,
+    get_lid_cache_object,
+    update_lid_cache_object,
+)
+
+
+def get_cutout_index(
+    bucket_name: str, lid: str, s3: BaseClient | None = None
+) -> dict | None:
+    """
+    Fetch the spatial index of cached FITS cutouts for a LID.
+
+    The index records the source image WCS header and shape (ny, nx), and for
+    each cached cutout, its cache key and its bounding box in source image
+    pixels (xmin, xmax, ymin, ymax; inclusive).
+
+    :param bucket_name: Name of the S3 bucket.
+    :param lid: PDS4 logical identifier.
+    :param s3: S3 client, default is a new client.
+    :return: The index, or None if there is no index.
+    """
+    return get_lid_cache_object(bucket_name, lid, 'index', s3)
+
+
+def add_to_cutout_index(
+    bucket_name: str,
+    lid: str,
+    file_key: str,
+    bbox: tuple[int, int, int, int],
+    wcs: WCS,
+    shape: tuple[int, int],
+    s3: BaseClient | None = None,
+) -> None:
+    """
+    Record a cached FITS cutout in the spatial index for its LID.
+
+    Concurrent writers may drop each other's entries.  That only costs a missed
+    reuse, never a wrong result.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param lid: PDS4 logical identifier.
+    :param file_key: Cache key of the FITS cutout.
+    :param bbox: Cutout bounding box in source image pixels.
+    :param wcs: Source image WCS.
+    :param shape: Source image shape.
+    :param s3: S3 client, default is a new client.
+    """
+
+    def update(index: dict | None) -> dict:
+        cutouts = [
+            entry
+            for entry in (index or {'cutouts': []})['cutouts']
+            if entry['key'] != file_key
+        ]
+        cutouts.append({'key': file_key, 'bbox': list(bbox)})
+        return {
+            'wcs': wcs.to_header(relax=True).tostring(),
+            'shape': list(shape),
+            'cutouts': cutouts[-MAX_ENTRIES_PER_LID:],
+        }
+
+    update_lid_cache_object(bucket_name, lid, 'index', update, s3)
+
+
+def find_cached_cutout(
+    index: dict | None, ra: float, dec: float, size: str
+) -> dict | None:
+    """
+    Find the smallest indexed cutout that entirely contains a request.
+
+    The request is converted to a bounding box in source image pixels once,
+    and compared with the bounding box of each cutout.
+
+    :param index: Spatial index from `get_cutout_index`.
+    :param ra: Right ascension in units of degrees.
+    :param dec: Declination in units of degrees.
+    :param size: Cutout size, parsable by `astropy.units.Quantity`.
+    :return: The index entry, or None if no cached cutout contains the request.
+    """
+    if not index:
+        return None
+
+    bbox = cutout_bbox(
+        fits.Header.fromstring(index['wcs']), index['shape'], ra, dec, size
+    )
+    if bbox is None:
+        return None
+
+    xmin, xmax, ymin, ymax = bbox
+
+    def contains(entry: dict) -> bool:
+        x0, x1, y0, y1 = entry['bbox']
+        return x0 <= xmin and xmax <= x1 and y0 <= ymin and ymax <= y1
+
+    def area(entry: dict) -> int:
+        x0, x1, y0, y1 = entry['bbox']
+        return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+    return min(filter(contains, index['cutouts']), key=area, default=None)
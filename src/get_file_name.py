@@ -35,6 +35,8 @@ def get_file_name(event: dict) -> str:
         image_filename = safe_filename.replace("_format_jpeg", "") + ".jpeg"
     elif "_format_png" in safe_filename.lower():
         image_filename = safe_filename.replace("_format_png", "") + ".png"
+    elif "_format_webp" in safe_filename.lower():
+        image_filename = safe_filename.replace("_format_webp", "") + ".webp"
     else:
         # must be FITS
         image_filename = safe_filename.replace("_format_fits", "") + ".fits"
@@ -1,9 +1,12 @@
 import io
 import boto3
+from botocore.client import BaseClient
 from botocore.exceptions import ClientError
 
 
-def get_image_from_s3_cache(bucket_name: str, file_key: str) -> io.BytesIO | None:
+def get_image_from_s3_cache(
+    bucket_name: str, file_key: str, s3: BaseClient | None = None
+) -> io.BytesIO | None:
     """
     Check if a file exists in an S3 bucket.
     If it exists, return the file as a BytesIO buffer.
@@ -11,11 +14,13 @@ def get_image_from_s3_cache(bucket_name: str, file_key: str) -> io.BytesIO | Non
 
     :param bucket_name: Name of the S3 bucket.
     :param file_key: Key of the file to check.
+    :param s3: S3 client, default is a new client.
     :return: True if the file exists, False otherwise.
     """
 
     # Check if file exists in S3
-    s3 = boto3.client('s3')
+    if s3 is None:
+        s3 = boto3.client('s3')
 
     try:
         # Attempt to fetch the metadata of the file
@@ -0,0 +1,129 @@
+import io
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image
+
+# (minimum, maximum, default) for each format's quality setting
+QUALITY: dict[str, tuple[int, int, int]] = {
+    "jpeg": (1, 95, 95),
+    "webp": (0, 100, 85),
+}
+
+# (minimum, maximum, default) for each format's compression effort setting,
+# i.e., PNG compress_level and WebP method
+EFFORT: dict[str, tuple[int, int, int]] = {
+    "png": (0, 9, 6),
+    "webp": (0, 6, 2),
+}
+
+# Pillow releases the GIL while encoding, so encodes submitted here run
+# alongside other work in the calling thread
+ENCODER_POOL: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1, thread_name_prefix="image-encoder"
+)
+
+
+def get_encoding_options(
+    image_format: str, quality: int | str | None = None, effort: int | str | None = None
+) -> dict[str, int]:
+    """Validate encoding options for an image format.
+
+
+    Parameters
+    ----------
+    image_format : str
+        jpeg, png, or webp.
+
+    quality : int or str, optional
+        Encoding quality, if supported by the format.  Default depends on the
+        format.
+
+    effort : int or str, optional
+        Compression effort, if supported by the format.  Default depends on the
+        format.
+
+
+    Returns
+    -------
+    options : dict
+        ``quality`` and/or ``effort``, for those supported by the format.
+
+
+    Raises
+    ------
+    ValueError
+        If an option is not an integer or is out of bounds.
+
+    """
+
+    options: dict[str, int] = {}
+    name: str
+    limits: dict[str, tuple[int, int, int]]
+    value: int | str | None
+    for name, limits, value in (
+        ("quality", QUALITY, quality),
+        ("effort", EFFORT, effort),
+    ):
+        if image_format not in limits:
+            continue
+
+        lower, upper, default = limits[image_format]
+        message: str = (
+            f"Invalid {name} for {image_format}. "
+            f"Must be an integer from {lower} to {upper}"
+        )
+        try:
+            options[name] = default if value is None else int(value)
+        except ValueError:
+            raise ValueError(message)
+
+        if not lower <= options[name] <= upper:
+            raise ValueError(message)
+
+    return options
+
+
+def encode_image(
+    image: Image.Image,
+    image_format: str,
+    quality: int | str | None = None,
+    effort: int | str | None = None,
+) -> io.BytesIO:
+    """Encode an image as JPEG, PNG, or WebP.
+
+    See `get_encoding_options` for the parameters.
+
+    """
+
+    options: dict[str, int] = get_encoding_options(image_format, quality, effort)
+
+    kwargs: dict[str, int] = {}
+    if image_format == "jpeg":
+        kwargs["quality"] = options["quality"]
+    elif image_format == "png":
+        kwargs["compress_level"] = options["effort"]
+    elif image_format == "webp":
+        kwargs["quality"] = options["quality"]
+        kwargs["method"] = options["effort"]
+    else:
+        raise ValueError(f"Unsupported image format: {image_format}")
+
+    buffer: io.BytesIO = io.BytesIO()
+    image.save(buffer, format=image_format, **kwargs)
+
+    return buffer
+
+
+def submit_encode(
+    image: Image.Image,
+    image_format: str,
+    quality: int | str | None = None,
+    effort: int | str | None = None,
+) -> Future:
+    """Encode an image with the shared encoder pool.
+
+    Returns a future for the `encode_image` result.
+
+    """
+    return ENCODER_POOL.submit(encode_image, image, image_format, quality, effort)
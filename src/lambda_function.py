@@ -1,24 +1,90 @@
 import os
 import io
+import json
 import base64
+import threading
 from enum import Enum
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from PIL import Image
+import boto3
+from botocore.client import BaseClient
 from astropy.io import fits
-from sbn_sis import cutout_handler, fits_to_image
+from astropy.nddata import NoOverlapError, PartialOverlapError
+from sbn_sis import (
+    CutoutSource,
+    cached_cutout_handler,
+    convert_dtype,
+    fits_to_image,
+)
 
 from get_file_name import get_file_name
+from bulk_lid_to_url import bulk_lid_to_url
+from image_encoder import get_encoding_options, submit_encode
 from set_image_to_s3_cache import set_image_to_s3_cache
 from get_image_from_s3_cache import get_image_from_s3_cache
+from cutout_index import get_cutout_index, add_to_cutout_index, find_cached_cutout
+from lid import InvalidLIDError
+from lid_to_url import validate_lid
+from negative_cache import (
+    NO_OVERLAP,
+    NOT_FOUND,
+    STATUS_CODES,
+    get_negative_cache_entry,
+    set_negative_cache_entry,
+    no_overlap_cutout,
+)
 
 
 class ImageFormat(Enum):
     FITS: str = "fits"
     JPEG: str = "jpeg"
     PNG: str = "png"
+    WEBP: str = "webp"
+
+
+class DataType(Enum):
+    FLOAT32: str = "float32"
+    INT16: str = "int16"
+
+
+# API Gateway resource of the URL resolution endpoint
+URLS_RESOURCE: str = "/api/urls"
+
+# Maximum number of LIDs per request to the URL resolution endpoint.  In the
+# worst case, every LID is from the Catalina Sky Survey and needs an S3
+# availability check.  At about 100 ms per check, 32 at a time, 2000 LIDs take
+# about 6 s.  If S3 is slower, the checks stop after BULK_CHECK_TIMEOUT (20 s),
+# within API Gateway's 29 s limit, and the remaining LIDs get PSI URLs.
+MAX_BULK_LIDS: int = 2000
+
+# One S3 client for all threads: clients are thread safe, but creating them from
+# boto3's default session is not
+S3_CLIENT: BaseClient = boto3.client("s3")
+
+# S3 requests run concurrently on this pool, which persists between invocations
+# of a warm Lambda instance
+IO_POOL: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=8, thread_name_prefix="sis-io"
+)
+
+# Speculative source preparation has its own pool, so that speculation left
+# running after cache hits never delays the S3 requests, including the cache
+# writes that must complete before returning
+SPECULATION_POOL: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="sis-speculation"
+)
 
 
 def lambda_handler(event: dict, context):
+    if event.get("resource") == URLS_RESOURCE:
+        if event.get("httpMethod") != "POST":
+            return {
+                "statusCode": 405,
+                "headers": {"Allow": "POST"},
+                "body": "Method not allowed. Must be POST",
+            }
+        return urls_handler(event)
+
     try:
         image_format: ImageFormat = ImageFormat(
             event["queryStringParameters"].get("format", "fits").lower()
@@ -26,18 +92,141 @@ def lambda_handler(event: dict, context):
     except ValueError:
         return {
             "statusCode": 400,
-            "body": "Invalid image format. Must be one of: fits, jpeg, png",
+            "body": "Invalid image format. Must be one of: fits, jpeg, png, webp",
         }
 
-    # Check for cached image
-    cached_filename = get_file_name(event)
+    query: dict = dict(event["queryStringParameters"])
+
+    # FITS output data type, default is that of the source.  Other formats do not
+    # use it, so it is not part of their cache key.
+    data_type: DataType | None = None
+    if image_format != ImageFormat.FITS:
+        query.pop("dtype", None)
+    elif "dtype" in query:
+        try:
+            data_type = DataType(query["dtype"].lower())
+        except ValueError:
+            return {
+                "statusCode": 400,
+                "body": "Invalid data type. Must be one of: float32, int16",
+            }
+        query["dtype"] = data_type.value
+
+    # Image encoding options; those that differ from the defaults are part of the
+    # cache key
+    try:
+        encoding: dict[str, int] = get_encoding_options(
+            image_format.value, query.pop("quality", None), query.pop("effort", None)
+        )
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "body": str(e),
+        }
+    defaults: dict[str, int] = get_encoding_options(image_format.value)
+    query.update(
+        {name: str(value) for name, value in encoding.items() if value != defaults[name]}
+    )
+
     caching_bucket = os.getenv("S3_CACHE_BUCKET_NAME", None)
     if not caching_bucket:
         return {
             "statusCode": 500,
             "body": "S3_CACHE_BUCKET_NAME environment variable not set",
         }
-    cached_file_buffer = get_image_from_s3_cache(caching_bucket, cached_filename)
+
+    cached_filename = get_file_name({**event, "queryStringParameters": query})
+    lid: str = event["pathParameters"]["lid"]
+    ra: float = float(event["queryStringParameters"]["ra"])
+    dec: float = float(event["queryStringParameters"]["dec"])
+    size: str = event["queryStringParameters"]["size"]
+
+    # Invalid LIDs are rejected by parsing alone, before any S3 requests
+    try:
+        validate_lid(lid)
+    except InvalidLIDError as e:
+        return {
+            "statusCode": 400,
+            "body": str(e),
+        }
+
+    # While the cache is checked, look up the negative cache and spatial index,
+    # and speculatively resolve the URL and read the source header for a miss
+    cancel: threading.Event = threading.Event()
+    negative_future: Future = IO_POOL.submit(
+        get_negative_cache_entry, caching_bucket, lid, ra, dec, size, S3_CLIENT
+    )
+    index_future: Future = IO_POOL.submit(
+        get_cutout_index, caching_bucket, lid, S3_CLIENT
+    )
+    source_future: Future = SPECULATION_POOL.submit(
+        _prepare_source, lid, negative_future, cancel
+    )
+
+    try:
+        return _cutout_response(
+            cached_filename,
+            caching_bucket,
+            lid,
+            ra,
+            dec,
+            size,
+            image_format,
+            data_type,
+            encoding,
+            negative_future,
+            index_future,
+            source_future,
+        )
+    finally:
+        _discard_source(source_future, cancel)
+
+
+def _prepare_source(
+    lid: str, negative_future: Future, cancel: threading.Event
+) -> CutoutSource | None:
+    """Open the source image, unless the request is negatively cached."""
+
+    try:
+        if negative_future.result():
+            return None
+    except Exception:
+        # the error is handled with the negative cache lookup
+        pass
+
+    return CutoutSource(lid, cancel)
+
+
+def _discard_source(source_future: Future, cancel: threading.Event) -> None:
+    """Cancel speculative source preparation, and close the source when opened."""
+
+    def close(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None and future.result():
+            future.result().close()
+
+    cancel.set()
+    if not source_future.cancel():
+        source_future.add_done_callback(close)
+
+
+def _cutout_response(
+    cached_filename: str,
+    caching_bucket: str,
+    lid: str,
+    ra: float,
+    dec: float,
+    size: str,
+    image_format: ImageFormat,
+    data_type: DataType | None,
+    encoding: dict[str, int],
+    negative_future: Future,
+    index_future: Future,
+    source_future: Future,
+) -> dict:
+    # Check for cached image
+    cached_file_buffer = get_image_from_s3_cache(
+        caching_bucket, cached_filename, S3_CLIENT
+    )
     if cached_file_buffer:
         return {
             "headers": {
@@ -51,26 +240,112 @@ def lambda_handler(event: dict, context):
             "isBase64Encoded": True,
         }
 
-    # No cached-file found, so fetch from the cutout service
-    hdu: fits.HDUList = cutout_handler(
-        event["pathParameters"]["lid"],
-        float(event["queryStringParameters"]["ra"]),
-        float(event["queryStringParameters"]["dec"]),
-        event["queryStringParameters"]["size"],
-    )
+    # Cache writes, completed before returning
+    writes: list[Future] = []
+
+    # No cached-file found, but the request may be known to fail or to not
+    # overlap the image
+    hdu: fits.HDUList | None = None
+    source: CutoutSource | None = None
+    bbox: tuple[int, int, int, int] | None = None
+    negative: dict | None = negative_future.result()
+    if negative:
+        if negative["outcome"] != NO_OVERLAP:
+            return {
+                "statusCode": STATUS_CODES[negative["outcome"]],
+                "body": negative["message"],
+            }
+        hdu = no_overlap_cutout(negative)
 
+    # Or, a larger cached FITS cutout of the same frame may contain the request
+    if hdu is None:
+        entry: dict | None = find_cached_cutout(index_future.result(), ra, dec, size)
+        if entry:
+            containing_buffer = get_image_from_s3_cache(
+                caching_bucket, entry["key"], S3_CLIENT
+            )
+            if containing_buffer:
+                try:
+                    hdu = cached_cutout_handler(
+                        fits.open(containing_buffer), ra, dec, size
+                    )
+                except (NoOverlapError, PartialOverlapError):
+                    pass
+
+    # Otherwise, fetch from the cutout service
+    if hdu is None:
+        try:
+            if source_future.cancel():
+                # speculation has not started, e.g., the pool is busy with that
+                # of earlier requests, so do not wait for it
+                source = CutoutSource(lid)
+            else:
+                source = source_future.result()
+
+            with source:
+                hdu, bbox = source.cutout(ra, dec, size, return_bbox=True)
+        except FileNotFoundError:
+            message: str = f"Image not found: {lid}"
+            set_negative_cache_entry(
+                caching_bucket, lid, NOT_FOUND, message, s3=S3_CLIENT
+            )
+            return {
+                "statusCode": STATUS_CODES[NOT_FOUND],
+                "body": message,
+            }
+        except TimeoutError:
+            return {
+                "statusCode": 504,
+                "body": f"Timed out reading from the image archive: {lid}",
+            }
+
+    # Encode images with the shared encoder pool, while the rest of the response
+    # is prepared
+    mime_type: str = f"image/{image_format.value}"
     buffer: io.BytesIO = io.BytesIO()
+    encoded: Future | None = None
     if image_format == ImageFormat.FITS:
+        if data_type is not None:
+            hdu = convert_dtype(hdu, data_type.value)
         hdu.writeto(buffer, output_verify="ignore")
     else:
-        image: Image = fits_to_image(hdu)
-        image.save(buffer, format=image_format.value, quality=95)
+        encoded = submit_encode(fits_to_image(hdu), image_format.value, **encoding)
 
-    mime_type = f"image/{image_format.value}"
+    # Positions cut from the source that do not overlap the image are
+    # negatively cached
+    if source is not None and bbox is None:
+        writes.append(
+            IO_POOL.submit(
+                set_negative_cache_entry,
+                caching_bucket,
+                lid,
+                NO_OVERLAP,
+                "Position does not overlap the image",
+                ra,
+                dec,
+                size,
+                hdu,
+                S3_CLIENT,
+            )
+        )
 
-    set_image_to_s3_cache(buffer, caching_bucket, cached_filename, mime_type)
+    # Index FITS cutouts cut from the source for later reuse, unless converted
+    # to another data type
+    if image_format == ImageFormat.FITS and data_type is None and bbox is not None:
+        writes.append(
+            IO_POOL.submit(
+                add_to_cutout_index,
+                caching_bucket,
+                lid,
+                cached_filename,
+                bbox,
+                source.wcs,
+                source.shape,
+                S3_CLIENT,
+            )
+        )
 
-    return {
+    response: dict = {
         "headers": {
             "Content-Type": mime_type,
             "Access-Control-Allow-Origin": "*",
@@ -78,6 +353,72 @@ def lambda_handler(event: dict, context):
             "Access-Control-Allow-Headers": "Content-Type, Authorization",
         },
         "statusCode": 200,
-        "body": base64.b64encode(buffer.getvalue()).decode("utf-8"),
         "isBase64Encoded": True,
     }
+
+    if encoded is not None:
+        buffer = encoded.result()
+    data: bytes = buffer.getvalue()
+
+    writes.append(
+        IO_POOL.submit(
+            set_image_to_s3_cache,
+            io.BytesIO(data),
+            caching_bucket,
+            cached_filename,
+            mime_type,
+            S3_CLIENT,
+        )
+    )
+
+    response["body"] = base64.b64encode(data).decode("utf-8")
+
+    # A frozen Lambda instance would not complete the writes, so wait.  The
+    # response is still good if caching failed.
+    future: Future
+    for future in writes:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Cache write failed: {e!r}")
+
+    return response
+
+
+def urls_handler(event: dict) -> dict:
+    """Resolve PDS4 LIDs to URLs.
+
+    The request body is a JSON object with a list of LIDs: {"lids": [...]}.
+    The response is a JSON list, see `bulk_lid_to_url`.
+
+    """
+
+    try:
+        body: str | bytes = event.get("body") or ""
+        if event.get("isBase64Encoded"):
+            body = base64.b64decode(body)
+        lids: list = json.loads(body)["lids"]
+        if not isinstance(lids, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return {
+            "statusCode": 400,
+            "body": 'Request body must be a JSON object: {"lids": [...]}',
+        }
+
+    if len(lids) > MAX_BULK_LIDS:
+        return {
+            "statusCode": 400,
+            "body": f"Too many LIDs. Maximum is {MAX_BULK_LIDS}",
+        }
+
+    return {
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization",
+        },
+        "statusCode": 200,
+        "body": json.dumps(bulk_lid_to_url(lids)),
+    }
@@ -1,13 +1,33 @@
 from typing import Any
 
 
+class InvalidLIDError(ValueError):
+    """Invalid or unsupported PDS4 logical identifier."""
+
+
 class LID:
-    """PDS4 logical identifier."""
+    """PDS4 logical identifier.
+
+    The identifier is split into its components once.  LIDs are immutable, so
+    ``LID(lid)`` returns ``lid`` itself when it is already a `LID`.
+
+    """
+
+    __slots__ = ("_lid", "_parts")
+
+    def __new__(cls, lid: Any) -> "LID":
+        if isinstance(lid, LID):
+            return lid
+        return super().__new__(cls)
 
     def __init__(self, lid: Any) -> None:
+        if lid is self:
+            return
+
         self._lid = str(lid)
         if not self._lid.startswith("urn:nasa:pds"):
-            raise ValueError(f"Invalid PDS4 LID: {lid}")
+            raise InvalidLIDError(f"Invalid PDS4 LID: {lid}")
+        self._parts = self._lid.split(":")
 
     def __str__(self) -> str:
         return self._lid
@@ -17,12 +37,12 @@ class LID:
 
     @property
     def bundle(self) -> str:
-        return self._lid.split(":")[3]
+        return self._parts[3]
 
     @property
     def collection(self) -> str:
-        return self._lid.split(":")[4]
+        return self._parts[4]
 
     @property
     def product_id(self) -> str:
-        return self._lid.split(":")[5]
+        return self._parts[5]
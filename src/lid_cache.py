@@ -0,0 +1,74 @@
+import re
+import json
+from typing import Callable
+import boto3
+from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+
+# Oldest entries are dropped beyond this many per LID, in each per-LID object
+MAX_ENTRIES_PER_LID: int = 64
+
+
+def get_lid_cache_key(lid: str, kind: str) -> str:
+    """
+    S3 key of a per-LID JSON object, e.g., <LID>.index.json for kind "index".
+    """
+    return re.sub(r"[/:?&=\.]", "_", str(lid)) + f".{kind}.json"
+
+
+def get_lid_cache_object(
+    bucket_name: str, lid: str, kind: str, s3: BaseClient | None = None
+) -> dict | None:
+    """
+    Fetch a per-LID JSON object from an S3 bucket.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param lid: PDS4 logical identifier.
+    :param kind: Kind of object, see `get_lid_cache_key`.
+    :param s3: S3 client, default is a new client.
+    :return: The object, or None if it does not exist.
+    """
+    if s3 is None:
+        s3 = boto3.client('s3')
+
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=get_lid_cache_key(lid, kind))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+    return json.loads(response['Body'].read())
+
+
+def update_lid_cache_object(
+    bucket_name: str,
+    lid: str,
+    kind: str,
+    update: Callable[[dict | None], dict],
+    s3: BaseClient | None = None,
+) -> None:
+    """
+    Read, update, and write back a per-LID JSON object in an S3 bucket.
+
+    Concurrent writers may drop each other's updates, so the objects must only
+    hold what is safe to lose.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param lid: PDS4 logical identifier.
+    :param kind: Kind of object, see `get_lid_cache_key`.
+    :param update: Function of the current object (None if it does not exist),
+        returning the new object.
+    :param s3: S3 client, default is a new client.
+    """
+    if s3 is None:
+        s3 = boto3.client('s3')
+
+    obj = update(get_lid_cache_object(bucket_name, lid, kind, s3))
+
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=get_lid_cache_key(lid, kind),
+        Body=json.dumps(obj).encode(),
+        ContentType='application/json',
+    )
@@ -1,7 +1,10 @@
 import os
 from typing import Callable
 import requests
-from lid import LID
+from lid import LID, InvalidLIDError
+
+# Seconds to wait for the upstream archive to connect or respond
+UPSTREAM_TIMEOUT: float = 10
 
 mm_to_Mon: dict[str, str] = {
     "01": "Jan",
@@ -33,18 +36,62 @@ def lid_to_url(lid: LID | str) -> str:
     -------
     url : string
 
+
+    Raises
+    ------
+    InvalidLIDError
+        If the LID is not valid for, or not from, a supported survey.
+
+    """
+
+    lid: LID = LID(lid)
+
+    try:
+        return LID_TO_URL[lid.bundle](lid)
+    except InvalidLIDError:
+        raise
+    except (KeyError, IndexError, ValueError) as e:
+        raise InvalidLIDError(f"Invalid or unsupported PDS4 LID: {lid}") from e
+
+
+def validate_lid(lid: LID | str) -> LID:
+    """Check that a PDS4 LID can be converted to a URL.
+
+    The LID is only parsed, i.e., Catalina Sky Survey data are not tested for
+    availability at S3.
+
+
+    Parameters
+    ----------
+    lid : LID
+        PDS4 LID.
+
+
+    Returns
+    -------
+    lid : LID
+
+
+    Raises
+    ------
+    InvalidLIDError
+        If the LID is not valid for, or not from, a supported survey.
+
     """
 
     lid: LID = LID(lid)
 
-    get_url: dict[str, Callable] = {
-        "gbo.ast.catalina.survey": css_lid_to_url,
-        "gbo.ast.spacewatch.survey": spacewatch_lid_to_url,
-        "gbo.ast.neat.survey": neat_lid_to_url,
-        "gbo.ast.loneos.survey": loneos_lid_to_url,
-    }
+    try:
+        if lid.bundle == "gbo.ast.catalina.survey":
+            css_lid_to_url_candidates(lid)
+        else:
+            LID_TO_URL[lid.bundle](lid)
+    except InvalidLIDError:
+        raise
+    except (KeyError, IndexError, ValueError) as e:
+        raise InvalidLIDError(f"Invalid or unsupported PDS4 LID: {lid}") from e
 
-    return get_url[lid.bundle](lid)
+    return lid
 
 
 def css_lid_to_url(lid: LID | str) -> str:
@@ -62,11 +109,73 @@ def css_lid_to_url(lid: LID | str) -> str:
     --> https://sbnarchive.psi.edu/pds4/surveys/gbo.ast.catalina.survey/data_calibrated/G96/2021/21Apr02/
         G96_20210402_2B_F5Q9M2_01_0001.arch.fz
 
-    The S3 file is tested for existence.  If not, PSI is used instead.
+    The S3 file is tested for existence.  If not, or if the test times out, PSI
+    is used instead.
+
+    """
+
+    aws_url: str | None
+    psi_url: str
+    aws_url, psi_url = css_lid_to_url_candidates(lid)
+
+    if aws_url is not None:
+        # at this moment, some files are missing from S3, if an HTTP request fails, use PSI
+        try:
+            response = requests.head(aws_url, timeout=UPSTREAM_TIMEOUT)
+            if response.status_code == 200:
+                return aws_url
+        except requests.Timeout:
+            pass
+
+    return psi_url
+
+
+def css_lid_to_url_candidates(lid: LID | str) -> tuple[str | None, str]:
+    """Catalina Sky Survey LID to S3 and PSI URLs, without testing either.
+
+    See `css_lid_to_url`.
+
+
+    Returns
+    -------
+    aws_url : string or None
+        The S3 URL, or `None` if the date is after S3_CSS_DATE_LIMIT.
+
+    psi_url : string
+
+    """
+
+    lid: LID = LID(lid)
+
+    try:
+        return css_product_urls(
+            lid.collection, lid.product_id, get_s3_css_date_limit()
+        )
+    except (IndexError, KeyError, ValueError):
+        raise InvalidLIDError(
+            f"Invalid Catalina Sky Survey PDS4 logical identifier: {lid}."
+        )
+
+
+def get_s3_css_date_limit() -> str:
+    """Last date of Catalina Sky Survey data at S3, YYYYMMDD.
+
+    From the S3_CSS_DATE_LIMIT environment variable.
+
+    """
+    return os.getenv("S3_CSS_DATE_LIMIT", "00000000")
+
+
+def css_product_urls(
+    collection: str, product_id: str, s3_date_limit: str
+) -> tuple[str | None, str]:
+    """Catalina Sky Survey collection and product ID to S3 and PSI URLs.
+
+    See `css_lid_to_url_candidates`.  Invalid product IDs raise `IndexError`,
+    `KeyError`, or `ValueError`.
 
     """
 
-    s3_date_limit: str = os.getenv("S3_CSS_DATE_LIMIT", "00000000")
     aws_base_url: str = (
         "https://pds-css-archive.s3.us-west-2.amazonaws.com/sbn/gbo.ast.catalina.survey"
     )
@@ -74,28 +183,19 @@ def css_lid_to_url(lid: LID | str) -> str:
         "https://sbnarchive.psi.edu/pds4/surveys/gbo.ast.catalina.survey"
     )
 
-    lid: LID = LID(lid)
-    basename: str = lid.product_id.upper()[: lid.product_id.index(".")]
-
+    basename: str = product_id.upper()[: product_id.index(".")]
     telescope: str
     date: str
-    YYMonDD: str
-    try:
-        telescope, date = basename.split("_")[:2]
-        YYMonDD = f"{date[2:4]}{mm_to_Mon[date[4:6]]}{date[6:8]}"
-    except IndexError:
-        raise ValueError(f"Invalid Catalina Sky Survey PDS4 logical identifier: {lid}.")
+    telescope, date = basename.split("_")[:2]
+    YYMonDD: str = f"{date[2:4]}{mm_to_Mon[date[4:6]]}{date[6:8]}"
 
-    path: str = f"{lid.collection}/{telescope}/{date[:4]}/{YYMonDD}/{basename}.arch.fz"
+    path: str = f"{collection}/{telescope}/{date[:4]}/{YYMonDD}/{basename}.arch.fz"
 
+    aws_url: str | None = None
     if date <= s3_date_limit:
-        # at this moment, some files are missing from S3, if an HTTP request fails, use PSI
-        url: str = "/".join((aws_base_url, path))
-        response = requests.head(url)
-        if response.status_code == 200:
-            return url
+        aws_url = "/".join((aws_base_url, path))
 
-    return "/".join((psi_base_url, path))
+    return aws_url, "/".join((psi_base_url, path))
 
 
 def spacewatch_lid_to_url(lid: LID | str) -> str:
@@ -119,6 +219,20 @@ def spacewatch_lid_to_url(lid: LID | str) -> str:
 
     lid: LID = LID(lid)
 
+    try:
+        return spacewatch_product_url(lid.collection, lid.product_id)
+    except ValueError:
+        raise InvalidLIDError(f"Invalid Spacewatch PDS4 logical identifier: {lid}")
+
+
+def spacewatch_product_url(collection: str, product_id: str) -> str:
+    """Spacewatch collection and product ID to URL, see `spacewatch_lid_to_url`.
+
+    All data are in one collection, so ``collection`` is not used.  Invalid
+    product IDs raise `ValueError`.
+
+    """
+
     base_url: str = (
         "https://sbnarchive.psi.edu/pds4/surveys/gbo.ast.spacewatch.survey/data"
     )
@@ -126,12 +240,9 @@ def spacewatch_lid_to_url(lid: LID | str) -> str:
     year: str
     month: str
     day: str
-    try:
-        year, month, day = lid.product_id.split("_")[-6:-3]
-    except IndexError:
-        raise ValueError(f"Invalid Spacewatch PDS4 logical identifier: {lid}")
+    year, month, day = product_id.split("_")[-6:-3]
 
-    return f"{base_url}/{year}/{month}/{day}/{lid.product_id}"
+    return f"{base_url}/{year}/{month}/{day}/{product_id}"
 
 
 def neat_lid_to_url(lid: LID | str) -> str:
@@ -139,12 +250,28 @@ def neat_lid_to_url(lid: LID | str) -> str:
 
     lid: LID = LID(lid)
 
-    get_url: dict[str, Callable] = {
-        "data_geodss": neat_geodss_lid_to_url,
-        "data_tricam": neat_tricam_lid_to_url,
-    }
+    return NEAT_LID_TO_URL[lid.collection](lid)
+
 
-    return get_url[lid.collection](lid)
+def neat_product_url(collection: str, product_id: str) -> str:
+    """NEAT collection and product ID to URL.
+
+    See `neat_geodss_lid_to_url` and `neat_tricam_lid_to_url`.  Collections
+    other than those raise `KeyError`.
+
+    """
+
+    if collection not in NEAT_LID_TO_URL:
+        raise KeyError(collection)
+
+    base_url: str = "https://sbnarchive.psi.edu/pds4/surveys/gbo.ast.neat.survey"
+
+    basename: str
+    directory: str
+    directory, basename = product_id.rsplit("_", 1)
+    directory = directory.replace("_", "/")
+
+    return f"{base_url}/{collection}/{directory}/{basename}.fit.fz"
 
 
 def neat_geodss_lid_to_url(lid: LID | str) -> str:
@@ -158,16 +285,7 @@ def neat_geodss_lid_to_url(lid: LID | str) -> str:
 
     lid: LID = LID(lid)
 
-    base_url: str = (
-        "https://sbnarchive.psi.edu/pds4/surveys/gbo.ast.neat.survey/data_geodss"
-    )
-
-    basename: str
-    directory: str
-    directory, basename = lid.product_id.rsplit("_", 1)
-    directory = directory.replace("_", "/")
-
-    return f"{base_url}/{directory}/{basename}.fit.fz"
+    return neat_product_url("data_geodss", lid.product_id)
 
 
 def neat_tricam_lid_to_url(lid: LID | str) -> str:
@@ -181,16 +299,7 @@ def neat_tricam_lid_to_url(lid: LID | str) -> str:
 
     lid: LID = LID(lid)
 
-    base_url: str = (
-        "https://sbnarchive.psi.edu/pds4/surveys/gbo.ast.neat.survey/data_tricam"
-    )
-
-    basename: str
-    directory: str
-    directory, basename = lid.product_id.rsplit("_", 1)
-    directory = directory.replace("_", "/")
-
-    return f"{base_url}/{directory}/{basename}.fit.fz"
+    return neat_product_url("data_tricam", lid.product_id)
 
 
 def loneos_lid_to_url(lid: LID | str) -> str:
@@ -212,8 +321,18 @@ def loneos_lid_to_url(lid: LID | str) -> str:
 
     lid: LID = LID(lid)
 
-    fn: str = lid.product_id[:-5] + ".fits"
-    date: str = lid.product_id[:6]
+    return loneos_product_url(lid.collection, lid.product_id)
+
+
+def loneos_product_url(collection: str, product_id: str) -> str:
+    """LONEOS collection and product ID to URL, see `loneos_lid_to_url`.
+
+    All data are in one collection, so ``collection`` is not used.
+
+    """
+
+    fn: str = product_id[:-5] + ".fits"
+    date: str = product_id[:6]
 
     lois: str
     if date < "050101":
@@ -226,3 +345,24 @@ def loneos_lid_to_url(lid: LID | str) -> str:
     )
 
     return f"{base_url}/{lois}/{date}/{fn}"
+
+
+NEAT_LID_TO_URL: dict[str, Callable] = {
+    "data_geodss": neat_geodss_lid_to_url,
+    "data_tricam": neat_tricam_lid_to_url,
+}
+
+LID_TO_URL: dict[str, Callable] = {
+    "gbo.ast.catalina.survey": css_lid_to_url,
+    "gbo.ast.spacewatch.survey": spacewatch_lid_to_url,
+    "gbo.ast.neat.survey": neat_lid_to_url,
+    "gbo.ast.loneos.survey": loneos_lid_to_url,
+}
+
+# Survey product URLs from the collection and product ID, except for the Catalina
+# Sky Survey, see `css_product_urls`
+PRODUCT_TO_URL: dict[str, Callable[[str, str], str]] = {
+    "gbo.ast.spacewatch.survey": spacewatch_product_url,
+    "gbo.ast.neat.survey": neat_product_url,
+    "gbo.ast.loneos.survey": loneos_product_url,
+}
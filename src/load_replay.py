@@ -0,0 +1,514 @@
+"""
+Replay cutout requests against lambda_handler under concurrency.
+
+Requests come from a JSONL file of API Gateway events (as built by
+local_lambda_run), or from a synthetic generator.  Each worker process plays
+the part of one Lambda instance.  The upstream archive is stood in for by a
+local HTTP server with range request support, serving synthetic frames for
+each LID, and the S3 cache by a directory shared by all workers.
+
+Reports throughput, latency percentiles, peak RSS per worker, and upstream
+bytes.
+
+    python load_replay.py --requests 200 --concurrency 4 --hit-ratio 0.3
+    python load_replay.py --log events.jsonl --concurrency 8
+
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import argparse
+import tempfile
+import resource
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from botocore.exceptions import ClientError
+from astropy.io import fits
+from astropy.wcs import WCS
+
+# Synthetic frame pixel scale, arcsec
+PIXEL_SCALE: float = 1.5
+
+LID_TEMPLATES: list[str] = [
+    "urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:"
+    "g96_20210402_2b_f5q9m2_01_{:04d}.arch",
+    "urn:nasa:pds:gbo.ast.spacewatch.survey:data:"
+    "sw_0996_SW403s_2003_07_08_08_40_33.{:03d}.fits",
+]
+
+
+class FileS3:
+    """
+    Directory-backed stand-in for the boto3 S3 client, shared between
+    processes.
+    """
+
+    def __init__(self, root: str, latency: float = 0):
+        self.root = root
+        self.latency = latency
+        self.calls: list[tuple[str, bool]] = []
+
+    def _path(self, Bucket: str, Key: str) -> str:
+        return os.path.join(self.root, Bucket, Key)
+
+    def _request(self, operation: str, Bucket: str, Key: str) -> str:
+        time.sleep(self.latency)
+        path = self._path(Bucket, Key)
+        self.calls.append((operation, os.path.exists(path)))
+        if not os.path.exists(path):
+            raise ClientError(
+                {"Error": {"Code": "404", "Message": "Not Found"}}, operation
+            )
+        return path
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        path = self._request("HeadObject", Bucket, Key)
+        return {"ContentLength": os.path.getsize(path)}
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        path = self._request("GetObject", Bucket, Key)
+        with open(path, "rb") as inf:
+            return {"Body": io.BytesIO(inf.read())}
+
+    def put_object(self, Bucket: str, Key: str, Body, **kwargs) -> dict:
+        time.sleep(self.latency)
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = Body if isinstance(Body, bytes) else Body.read()
+
+        # write then rename, so concurrent readers never see partial objects
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), delete=False
+        ) as outf:
+            outf.write(data)
+        os.replace(outf.name, path)
+        return {}
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves files from the server's directory, with byte-range support."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_head(self) -> tuple[str, int, int] | None:
+        path = os.path.join(self.server.directory, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        time.sleep(self.server.latency)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            if match[1]:
+                start = int(match[1])
+                end = min(int(match[2]), end) if match[2] else end
+            else:
+                start = max(size - int(match[2]), 0)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", "application/fits")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return path, start, end
+
+    def do_HEAD(self):
+        self._send_head()
+
+    def do_GET(self):
+        head = self._send_head()
+        if head is None:
+            return
+
+        path, start, end = head
+        with open(path, "rb") as inf:
+            inf.seek(start)
+            data = inf.read(end - start + 1)
+        self.wfile.write(data)
+
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_sent += len(data)
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    """Local stand-in for the upstream image archive."""
+
+    daemon_threads = True
+
+    def __init__(self, directory: str, latency: float = 0):
+        super().__init__(("127.0.0.1", 0), RangeRequestHandler)
+        self.directory = directory
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def handle_error(self, request, client_address):
+        # clients may drop connections, e.g., cancelled speculative reads
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def frame_file_name(lid: str) -> str:
+    return re.sub(r"[/:?&=]", "_", lid) + ".fits"
+
+
+def make_frame(lid: str, ra: float, dec: float, shape: int, path: str) -> None:
+    """
+    Write a synthetic survey frame centered on ra, dec: sky, noise, and stars.
+
+    Catalina Sky Survey frames are tile compressed in the first extension, as
+    in the archive, others are uncompressed primary arrays.
+    """
+    rng = np.random.default_rng(zlib.crc32(lid.encode()))
+    data = rng.normal(2500, 30, (shape, shape))
+    for x0, y0 in rng.uniform(0, shape, (shape // 20, 2)):
+        y, x = np.ogrid[
+            max(int(y0) - 8, 0) : min(int(y0) + 8, shape),
+            max(int(x0) - 8, 0) : min(int(x0) + 8, shape),
+        ]
+        data[y, x] += rng.lognormal(8, 1.5) * np.exp(
+            -((x - x0) ** 2 + (y - y0) ** 2) / 4.5
+        )
+    data = np.clip(data, 0, 65535).astype(np.uint16)
+
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    wcs.wcs.crval = [ra, dec]
+    wcs.wcs.crpix = [(shape + 1) / 2, (shape + 1) / 2]
+    wcs.wcs.cdelt = [-PIXEL_SCALE / 3600, PIXEL_SCALE / 3600]
+    header = wcs.to_header()
+
+    # cutout_handler treats CSS and Spacewatch WCS as TPV, which needs the
+    # linear terms of the distortion polynomial
+    if "catalina" in lid or "spacewatch" in lid:
+        header["PV1_1"] = 1.0
+        header["PV2_1"] = 1.0
+
+    if "catalina" in lid:
+        hdu = fits.HDUList(
+            [
+                fits.PrimaryHDU(),
+                fits.CompImageHDU(data, header, compression_type="RICE_1"),
+            ]
+        )
+    else:
+        hdu = fits.HDUList([fits.PrimaryHDU(data, header)])
+
+    hdu.writeto(path, overwrite=True)
+
+
+def synthetic_events(
+    n: int,
+    hit_ratio: float,
+    formats: dict[str, float],
+    sizes: dict[str, float],
+    frames: int,
+    shape: int,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Generate API Gateway events.
+
+    A fraction ``hit_ratio`` of the events repeat an earlier event, so would be
+    served from the cache.  The rest are at random positions on ``frames``
+    frames, with formats and sizes drawn from the given weights.
+    """
+    rng = np.random.default_rng(seed)
+    lids = [LID_TEMPLATES[i % len(LID_TEMPLATES)].format(i + 1) for i in range(frames)]
+    half_width = shape * PIXEL_SCALE / 3600 / 2
+
+    def choice(weights: dict[str, float]) -> str:
+        p = np.array(list(weights.values()), float)
+        return str(rng.choice(list(weights.keys()), p=p / p.sum()))
+
+    events: list[dict] = []
+    for i in range(n):
+        if events and rng.random() < hit_ratio:
+            events.append(events[rng.integers(len(events))])
+            continue
+
+        lid = lids[rng.integers(frames)]
+        ra, dec = rng.uniform(-half_width, half_width, 2) * 0.9 + [180.0, 0.0]
+        events.append(
+            {
+                "httpMethod": "GET",
+                "resource": "/api/images/{lid}",
+                "path": f"/api/images/{lid}",
+                "queryStringParameters": {
+                    "ra": f"{ra:.5f}",
+                    "dec": f"{dec:.5f}",
+                    "size": choice(sizes),
+                    "format": choice(formats),
+                },
+                "pathParameters": {"lid": lid},
+            }
+        )
+
+    return events
+
+
+def read_events(filename: str) -> list[dict]:
+    """Read API Gateway events, one JSON object per line."""
+    with open(filename) as inf:
+        return [json.loads(line) for line in inf if line.strip()]
+
+
+def prepare_frames(events: list[dict], directory: str, shape: int) -> None:
+    """
+    Write a synthetic frame for each LID in the events, centered on the mean
+    requested position.
+    """
+    positions: dict[str, list[tuple[float, float]]] = {}
+    for event in events:
+        query = event["queryStringParameters"]
+        positions.setdefault(event["pathParameters"]["lid"], []).append(
+            (float(query["ra"]), float(query["dec"]))
+        )
+
+    for lid, radec in positions.items():
+        ra, dec = np.mean(radec, axis=0)
+        make_frame(lid, ra, dec, shape, os.path.join(directory, frame_file_name(lid)))
+
+
+# worker process state
+_s3: FileS3 | None = None
+
+
+def _init_worker(cache_directory: str, upstream_url: str, latency: float) -> None:
+    global _s3
+
+    # silence cache miss messages
+    sys.stdout = open(os.devnull, "w")
+
+    import boto3
+    import sbn_sis
+
+    _s3 = FileS3(cache_directory, latency)
+    boto3.client = lambda *args, **kwargs: _s3
+    sbn_sis.lid_to_url = lambda lid: f"{upstream_url}/{frame_file_name(str(lid))}"
+    os.environ["S3_CACHE_BUCKET_NAME"] = "load-replay"
+
+    # import and warm up outside of the timed requests
+    import lambda_function  # noqa: F401
+
+
+def _run_event(event: dict) -> dict:
+    from lambda_function import lambda_handler
+
+    _s3.calls.clear()
+    start = time.perf_counter()
+    try:
+        response = lambda_handler(event, None)
+        status = response["statusCode"]
+        nbytes = len(response.get("body", ""))
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        status, nbytes = 500, 0
+    latency = time.perf_counter() - start
+
+    return {
+        "pid": os.getpid(),
+        "latency": latency,
+        "status": status,
+        "bytes": nbytes,
+        # the first HEAD is for the requested cache key
+        "hit": next((found for op, found in _s3.calls if op == "HeadObject"), False),
+        "format": event["queryStringParameters"].get("format", "fits"),
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def replay(
+    events: list[dict],
+    concurrency: int,
+    frame_shape: int = 2048,
+    latency: float = 0,
+) -> dict:
+    """
+    Replay events against lambda_handler with ``concurrency`` worker processes.
+
+
+    Parameters
+    ----------
+    events : list of dict
+        API Gateway events.
+
+    concurrency : int
+        Number of worker processes, i.e., concurrent Lambda instances.
+
+    frame_shape : int, optional
+        Size of the synthetic frames, pixels.
+
+    latency : float, optional
+        Added latency of each upstream and S3 request, seconds.
+
+
+    Returns
+    -------
+    report : dict
+
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        frames = os.path.join(directory, "frames")
+        cache = os.path.join(directory, "cache")
+        os.makedirs(frames)
+        prepare_frames(events, frames, frame_shape)
+
+        server = UpstreamServer(frames, latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        context = multiprocessing.get_context("spawn")
+        try:
+            with context.Pool(
+                concurrency,
+                initializer=_init_worker,
+                initargs=(cache, server.url, latency),
+            ) as pool:
+                # make sure all workers have started before timing
+                pool.map(time.sleep, [0.1] * concurrency)
+
+                start = time.perf_counter()
+                results = list(pool.imap_unordered(_run_event, events))
+                elapsed = time.perf_counter() - start
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    latencies = np.array([r["latency"] for r in results])
+    hits = np.array([r["hit"] for r in results])
+    max_rss: dict[int, int] = {}
+    for r in results:
+        max_rss[r["pid"]] = max(max_rss.get(r["pid"], 0), r["max_rss"])
+
+    def percentiles(x: np.ndarray) -> dict[str, float]:
+        if len(x) == 0:
+            return {"p50": np.nan, "p99": np.nan}
+        return {"p50": float(np.percentile(x, 50)), "p99": float(np.percentile(x, 99))}
+
+    return {
+        "requests": len(results),
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "throughput": len(results) / elapsed,
+        "errors": int(sum(r["status"] >= 500 for r in results)),
+        "hit_ratio": float(hits.mean()) if len(hits) else np.nan,
+        "latency": percentiles(latencies),
+        "hit_latency": percentiles(latencies[hits]),
+        "miss_latency": percentiles(latencies[~hits]),
+        "response_bytes": int(sum(r["bytes"] for r in results)),
+        "upstream_requests": server.requests,
+        "upstream_bytes": server.bytes_sent,
+        "max_rss": sorted(max_rss.values()),
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"requests           {report['requests']} ({report['errors']} errors)")
+    print(f"concurrency        {report['concurrency']}")
+    print(f"throughput         {report['throughput']:.1f} requests/s")
+    print(f"cache hit ratio    {report['hit_ratio']:.2f}")
+    for name in ["latency", "hit_latency", "miss_latency"]:
+        p = report[name]
+        label = name.replace("_", " ")
+        print(
+            f"{label:18} p50 {p['p50'] * 1000:.1f} ms, p99 {p['p99'] * 1000:.1f} ms"
+        )
+    print(f"response bytes     {report['response_bytes']}")
+    print(
+        f"upstream           {report['upstream_requests']} requests, "
+        f"{report['upstream_bytes']} bytes"
+    )
+    rss = ", ".join(f"{x / 2**20:.0f}" for x in report["max_rss"])
+    print(f"peak RSS / worker  {rss} MiB")
+
+
+def weights(arg: str) -> dict[str, float]:
+    """Parse "a:0.5,b:0.5" into weights."""
+    return {
+        key: float(value)
+        for key, value in (item.split(":") for item in arg.split(","))
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay cutout requests against lambda_handler under concurrency."
+    )
+    parser.add_argument("--log", help="JSONL file of API Gateway events to replay")
+    parser.add_argument("--concurrency", type=int, default=4, help="worker processes")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="added upstream and S3 latency, ms"
+    )
+    parser.add_argument(
+        "--frame-shape", type=int, default=2048, help="synthetic frame size, pixels"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=100, help="number of synthetic requests"
+    )
+    parser.add_argument(
+        "--hit-ratio", type=float, default=0.3, help="synthetic repeated requests"
+    )
+    parser.add_argument(
+        "--formats",
+        type=weights,
+        default="fits:0.4,jpeg:0.3,png:0.1,webp:0.2",
+        help="synthetic format mix",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=weights,
+        default="1arcmin:0.3,5arcmin:0.5,10arcmin:0.2",
+        help="synthetic size distribution",
+    )
+    parser.add_argument("--frames", type=int, default=4, help="synthetic frames")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic random seed")
+    parser.add_argument(
+        "--write-log", help="save the events to this JSONL file and exit"
+    )
+    parser.add_argument("--json", action="store_true", help="print report as JSON")
+    args = parser.parse_args()
+
+    events: list[dict]
+    if args.log:
+        events = read_events(args.log)
+    else:
+        events = synthetic_events(
+            args.requests,
+            args.hit_ratio,
+            args.formats,
+            args.sizes,
+            args.frames,
+            args.frame_shape,
+            args.seed,
+        )
+
+    if args.write_log:
+        with open(args.write_log, "w") as outf:
+            outf.writelines(json.dumps(event) + "\n" for event in events)
+        sys.exit()
+
+    report = replay(events, args.concurrency, args.frame_shape, args.latency / 1000)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
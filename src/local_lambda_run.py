@@ -10,6 +10,7 @@ def local_lambda_run():
 
     event = {
         "httpMethod": "GET",
+        "resource": "/api/images/{lid}",
         "path": "/api/images/urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:703_20220122_2b_n32022_01_0003.arch",
         "headers": {
             "Host": "localhost:3000",
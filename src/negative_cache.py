@@ -0,0 +1,140 @@
+import os
+import time
+import numpy as np
+from botocore.client import BaseClient
+from astropy.io import fits
+
+from lid_cache import (
+    MAX_ENTRIES_PER_LID,
+    get_lid_cache_object,
+    update_lid_cache_object,
+)
+
+# Outcomes that may be negatively cached, and their HTTP status codes.  A
+# no-overlap outcome is served as the stored 1x1 NaN cutout.  Invalid LIDs are
+# rejected before the cache is checked, so they are not negatively cached.
+NOT_FOUND: str = "not_found"
+NO_OVERLAP: str = "no_overlap"
+STATUS_CODES: dict[str, int] = {
+    NOT_FOUND: 404,
+    NO_OVERLAP: 200,
+}
+
+
+def get_negative_cache_ttl() -> float:
+    """
+    Negative cache time to live in seconds, from the NEGATIVE_CACHE_TTL
+    environment variable (default 1 hour).  Zero disables negative caching.
+    """
+    return float(os.getenv("NEGATIVE_CACHE_TTL", 3600))
+
+
+def _position_key(ra: float, dec: float, size: str) -> str:
+    return f"{float(ra)!r} {float(dec)!r} {size}"
+
+
+def get_negative_cache_entry(
+    bucket_name: str,
+    lid: str,
+    ra: float,
+    dec: float,
+    size: str,
+    s3: BaseClient | None = None,
+) -> dict | None:
+    """
+    Check for an unexpired negative cache entry for a cutout request.
+
+    An entry for the whole LID (not found upstream) takes precedence over a
+    no-overlap entry for the requested position and size.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param lid: PDS4 logical identifier.
+    :param ra: Right ascension in units of degrees.
+    :param dec: Declination in units of degrees.
+    :param size: Cutout size.
+    :param s3: S3 client, default is a new client.
+    :return: The entry, with the outcome, a message, and the expiration time,
+        or None.
+    """
+    if get_negative_cache_ttl() <= 0:
+        return None
+
+    entries = get_lid_cache_object(bucket_name, lid, "negative", s3)
+    if entries is None:
+        return None
+
+    now = time.time()
+    entry = entries["lid"]
+    if entry is None or entry["expires"] <= now:
+        entry = entries["positions"].get(_position_key(ra, dec, size))
+        if entry is None or entry["expires"] <= now:
+            return None
+
+    return entry
+
+
+def set_negative_cache_entry(
+    bucket_name: str,
+    lid: str,
+    outcome: str,
+    message: str,
+    ra: float | None = None,
+    dec: float | None = None,
+    size: str | None = None,
+    hdu: fits.HDUList | None = None,
+    s3: BaseClient | None = None,
+) -> None:
+    """
+    Record a failed or empty cutout request in the negative cache.
+
+    Not-found outcomes apply to the whole LID.  No-overlap outcomes apply to the
+    position and size, and store the resulting cutout header.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param lid: PDS4 logical identifier.
+    :param outcome: NOT_FOUND or NO_OVERLAP.
+    :param message: Description of the outcome, returned for errors.
+    :param ra, dec, size: Cutout request, required for NO_OVERLAP.
+    :param hdu: The 1x1 NaN cutout, required for NO_OVERLAP.
+    :param s3: S3 client, default is a new client.
+    """
+    ttl = get_negative_cache_ttl()
+    if ttl <= 0:
+        return
+
+    now = time.time()
+    entry: dict = {
+        "outcome": outcome,
+        "message": message,
+        "expires": now + ttl,
+    }
+    if outcome == NO_OVERLAP:
+        entry["header"] = hdu[0].header.tostring()
+
+    def update(entries: dict | None) -> dict:
+        entries = entries or {"lid": None, "positions": {}}
+        positions: dict = {
+            key: value
+            for key, value in entries["positions"].items()
+            if value["expires"] > now
+        }
+        if outcome != NO_OVERLAP:
+            return {"lid": entry, "positions": positions}
+
+        positions[_position_key(ra, dec, size)] = entry
+        return {
+            "lid": entries["lid"],
+            "positions": dict(list(positions.items())[-MAX_ENTRIES_PER_LID:]),
+        }
+
+    update_lid_cache_object(bucket_name, lid, "negative", update, s3)
+
+
+def no_overlap_cutout(entry: dict) -> fits.HDUList:
+    """
+    The 1x1 NaN cutout stored with a no-overlap negative cache entry.
+    """
+    header = fits.Header.fromstring(entry["header"])
+    result = fits.HDUList()
+    result.append(fits.PrimaryHDU(np.array([[np.nan]]), header))
+    return result
@@ -1,5 +1,8 @@
 import warnings
+import threading
 from copy import copy
+from concurrent.futures import CancelledError
+import aiohttp
 from PIL import Image
 import numpy as np
 import astropy.units as u
@@ -7,12 +10,15 @@ from astropy.io import fits
 from astropy.nddata import Cutout2D, NoOverlapError
 from astropy.coordinates import SkyCoord
 from astropy.wcs import WCS, FITSFixedWarning
+from astropy.wcs.utils import proj_plane_pixel_scales, skycoord_to_pixel
 from astropy.visualization import ZScaleInterval
 from lid import LID
-from lid_to_url import lid_to_url
+from lid_to_url import lid_to_url, UPSTREAM_TIMEOUT
 
 
-def cutout_handler(lid: str, ra: float, dec: float, size: str) -> fits.HDUList:
+def cutout_handler(
+    lid: str, ra: float, dec: float, size: str, return_bbox: bool = False
+) -> fits.HDUList | tuple[fits.HDUList, tuple[int, int, int, int] | None]:
     """Entry point for getting image cutouts.
 
 
@@ -30,67 +36,347 @@ def cutout_handler(lid: str, ra: float, dec: float, size: str) -> fits.HDUList:
     size : string
         Cutout size, parsable by `astropy.units.Quantity`.  Minimum 1 arcsec.
 
+    return_bbox : bool, optional
+        Also return the bounding box of the cutout in source image pixels.
+
 
     Returns
     -------
     cutout : fits.HDUList
 
+    bbox : tuple of int or None
+        ``(xmin, xmax, ymin, ymax)``, inclusive, in source image pixels.  `None`
+        if the position does not overlap the image.  Only returned when
+        ``return_bbox`` is `True`.
+
     """
 
-    lid: LID = LID(lid)
+    with CutoutSource(lid) as source:
+        return source.cutout(ra, dec, size, return_bbox=return_bbox)
 
-    position: SkyCoord = SkyCoord(ra, dec, unit=(u.deg, u.deg))
-    _size: u.Quantity = np.maximum(u.Quantity(size), 1 * u.arcsec)
 
-    url: str = lid_to_url(lid)
+class CutoutSource:
+    """A source image, opened for cutouts.
 
-    fsspec_kwargs = {}
-    if url.startswith("s3"):
-        fsspec_kwargs["anon"] = True
-    else:
-        # for http or even local files:
-        fsspec_kwargs.update({"block_size": 1024 * 512, "cache_type": "bytes"})
-
-    data: fits.HDUList
-    with fits.open(
-        url,
-        cache=False,
-        use_fsspec=True,
-        lazy_load_hdus=True,
-        fsspec_kwargs=fsspec_kwargs,
-    ) as data:
-        i: int = 0
-        if lid.bundle == "gbo.ast.catalina.survey":
-            i = 1
-
-        header: fits.Header = copy(data[i].header)
-
-        # use distortions in CSS and SW data
-        if lid.bundle in ["gbo.ast.catalina.survey", "gbo.ast.spacewatch.survey"]:
-            header["CTYPE1"] = "RA---TPV"
-            header["CTYPE2"] = "DEC--TPV"
-
-        with warnings.catch_warnings():
-            warnings.simplefilter(
-                "ignore", (fits.verify.VerifyWarning, FITSFixedWarning)
-            )
-            wcs: WCS = WCS(header)
+    The URL is resolved and the header is read when the source is opened.  Pixel
+    data are read by `cutout`.
+
+
+    Parameters
+    ----------
+    lid : LID
+        PDS4 logical identifier.
+
+    cancel : threading.Event, optional
+        Opening is abandoned with `concurrent.futures.CancelledError` if this
+        event is set before each upstream request: URL resolution (an HTTP
+        HEAD for some Catalina Sky Survey data), opening the file, and reading
+        the image header.  Each request times out after `UPSTREAM_TIMEOUT`
+        seconds without a response.
+
+    """
+
+    def __init__(self, lid: str, cancel: threading.Event | None = None) -> None:
+        self.lid: LID = LID(lid)
+
+        if cancel is not None and cancel.is_set():
+            raise CancelledError
+
+        self.url: str = lid_to_url(self.lid)
+
+        fsspec_kwargs = {}
+        if self.url.startswith("s3"):
+            fsspec_kwargs["anon"] = True
+            fsspec_kwargs["config_kwargs"] = {
+                "connect_timeout": UPSTREAM_TIMEOUT,
+                "read_timeout": UPSTREAM_TIMEOUT,
+            }
+        else:
+            # for http or even local files:
+            fsspec_kwargs.update({"block_size": 1024 * 512, "cache_type": "bytes"})
+            if self.url.startswith("http"):
+                fsspec_kwargs["client_kwargs"] = {
+                    "timeout": aiohttp.ClientTimeout(
+                        sock_connect=UPSTREAM_TIMEOUT, sock_read=UPSTREAM_TIMEOUT
+                    )
+                }
+
+        if cancel is not None and cancel.is_set():
+            raise CancelledError
+
+        self._data: fits.HDUList = fits.open(
+            self.url,
+            cache=False,
+            use_fsspec=True,
+            lazy_load_hdus=True,
+            fsspec_kwargs=fsspec_kwargs,
+        )
+
+        try:
+            if cancel is not None and cancel.is_set():
+                raise CancelledError
+
+            i: int = 0
+            if self.lid.bundle == "gbo.ast.catalina.survey":
+                i = 1
+
+            self._hdu = self._data[i]
+            self.header: fits.Header = copy(self._hdu.header)
+            self.shape: tuple[int, int] = self._hdu.shape
+
+            # use distortions in CSS and SW data
+            if self.lid.bundle in [
+                "gbo.ast.catalina.survey",
+                "gbo.ast.spacewatch.survey",
+            ]:
+                self.header["CTYPE1"] = "RA---TPV"
+                self.header["CTYPE2"] = "DEC--TPV"
+
+            with warnings.catch_warnings():
+                warnings.simplefilter(
+                    "ignore", (fits.verify.VerifyWarning, FITSFixedWarning)
+                )
+                self.wcs: WCS = WCS(self.header)
+        except BaseException:
+            self._data.close()
+            raise
+
+    def __enter__(self) -> "CutoutSource":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._data.close()
+
+    def cutout(
+        self, ra: float, dec: float, size: str, return_bbox: bool = False
+    ) -> fits.HDUList | tuple[fits.HDUList, tuple[int, int, int, int] | None]:
+        """Cut out part of the source image.
+
+        See `cutout_handler` for the parameters and return values.
+
+        """
+
+        position: SkyCoord = SkyCoord(ra, dec, unit=(u.deg, u.deg))
+        _size: u.Quantity = np.maximum(u.Quantity(size), 1 * u.arcsec)
+
+        header: fits.Header = copy(self.header)
 
         cutout_image: np.ndarray
+        bbox: tuple[int, int, int, int] | None = None
         try:
-            cutout: Cutout2D = Cutout2D(data[i].section, position, _size, wcs=wcs)
+            cutout: Cutout2D = Cutout2D(
+                self._hdu.section, position, _size, wcs=self.wcs
+            )
             cutout_image = cutout.data
             header.update(cutout.wcs.to_header())
+            bbox = (
+                int(cutout.xmin_original),
+                int(cutout.xmax_original),
+                int(cutout.ymin_original),
+                int(cutout.ymax_original),
+            )
         except NoOverlapError:
-            pix = wcs.world_to_pixel(position)
+            pix = self.wcs.world_to_pixel(position)
             header["CRPIX1"] = float(pix[0])
             header["CRPIX2"] = float(pix[1])
             header["CRVAL1"] = position.ra.deg
             header["CRVAL2"] = position.dec.deg
             cutout_image = np.array([[np.nan]])
 
+        result: fits.HDUList = fits.HDUList()
+        result.append(fits.PrimaryHDU(cutout_image, header))
+
+        if return_bbox:
+            return result, bbox
+
+        return result
+
+
+def cached_cutout_handler(
+    cached: fits.HDUList, ra: float, dec: float, size: str
+) -> fits.HDUList:
+    """Cut a smaller cutout out of a previously cached FITS cutout.
+
+    The cached cutout's header carries the source WCS shifted to the cutout
+    origin, so the result matches what `cutout_handler` would produce from the
+    source image.
+
+
+    Parameters
+    ----------
+    cached : fits.HDUList
+        A FITS cutout previously produced by `cutout_handler`.
+
+    ra : float
+        Right ascension in units of degrees.
+
+    dec : float
+        Declination in units of degrees.
+
+    size : string
+        Cutout size, parsable by `astropy.units.Quantity`.  Minimum 1 arcsec.
+
+
+    Returns
+    -------
+    cutout : fits.HDUList
+
+
+    Raises
+    ------
+    PartialOverlapError, NoOverlapError
+        If the requested cutout does not fall entirely inside ``cached``.
+
+    """
+
+    position: SkyCoord = SkyCoord(ra, dec, unit=(u.deg, u.deg))
+    _size: u.Quantity = np.maximum(u.Quantity(size), 1 * u.arcsec)
+
+    header: fits.Header = copy(cached[0].header)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", (fits.verify.VerifyWarning, FITSFixedWarning))
+        wcs: WCS = WCS(header)
+
+    cutout: Cutout2D = Cutout2D(
+        cached[0].data, position, _size, wcs=wcs, mode="strict"
+    )
+    header.update(cutout.wcs.to_header())
+
+    result: fits.HDUList = fits.HDUList()
+    result.append(fits.PrimaryHDU(cutout.data, header))
+
+    return result
+
+
+def cutout_bbox(
+    header: fits.Header, shape: tuple[int, int], ra: float, dec: float, size: str
+) -> tuple[int, int, int, int] | None:
+    """Bounding box of a cutout request in image pixels.
+
+    Only the image WCS and shape are needed, so this can be evaluated without
+    reading any pixel data.  Unlike the bounding box from `cutout_handler`, the
+    box is not trimmed to the image.
+
+
+    Parameters
+    ----------
+    header : fits.Header
+        Header with the image WCS.
+
+    shape : tuple of int
+        Image shape, ``(ny, nx)``.
+
+    ra, dec, size :
+        As for `cutout_handler`.
+
+
+    Returns
+    -------
+    bbox : tuple of int or None
+        ``(xmin, xmax, ymin, ymax)``, inclusive, or `None` if the request does
+        not overlap the image.
+
+    """
+
+    position: SkyCoord = SkyCoord(ra, dec, unit=(u.deg, u.deg))
+    _size: u.Quantity = np.maximum(u.Quantity(size), 1 * u.arcsec)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", (fits.verify.VerifyWarning, FITSFixedWarning))
+        wcs: WCS = WCS(header)
+
+    # the box is computed as by `Cutout2D`, without allocating the cutout
+    x: float
+    y: float
+    x, y = skycoord_to_pixel(position, wcs, mode="all")
+    if not np.isfinite([x, y]).all():
+        return None
+
+    pixel_scales: u.Quantity = u.Quantity(
+        proj_plane_pixel_scales(wcs), wcs.wcs.cunit[0]
+    )
+    ny: int = int(np.round((_size / pixel_scales[0]).decompose()))
+    nx: int = int(np.round((_size / pixel_scales[1]).decompose()))
+    ymin: int = int(np.ceil(y - ny / 2.0))
+    xmin: int = int(np.ceil(x - nx / 2.0))
+
+    if xmin + nx <= 0 or ymin + ny <= 0 or xmin >= shape[1] or ymin >= shape[0]:
+        return None
+
+    return (xmin, xmin + nx - 1, ymin, ymin + ny - 1)
+
+
+def convert_dtype(hdu: fits.HDUList, dtype: str) -> fits.HDUList:
+    """Convert cutout data to a smaller output data type.
+
+
+    Parameters
+    ----------
+    hdu : fits.HDUList
+        Cutout from `cutout_handler`.
+
+    dtype : string
+        Output data type:
+
+        * ``"float32"``: IEEE single precision, relative error <= 2**-24.
+          Data already stored with 4 or fewer bytes per pixel, e.g., 16-bit
+          integers, are returned unchanged.
+        * ``"int16"``: linearly quantized with BSCALE and BZERO over the range
+          of finite values, absolute error <= BSCALE / 2 = (max - min) /
+          131068.  Non-finite values are stored as BLANK and read back as NaN.
+
+
+    Returns
+    -------
+    converted : fits.HDUList
+
+    """
+
+    if dtype == "float32" and hdu[0].data.dtype.itemsize <= 4:
+        # converting would not reduce the size, and may increase it
+        return hdu
+
+    header: fits.Header = copy(hdu[0].header)
+    for keyword in ["BSCALE", "BZERO", "BLANK"]:
+        header.remove(keyword, ignore_missing=True)
+
+    data: np.ndarray = np.asarray(hdu[0].data, dtype=np.float64)
+
+    converted: fits.PrimaryHDU
+    if dtype == "float32":
+        converted = fits.PrimaryHDU(data.astype(np.float32), header)
+    elif dtype == "int16":
+        finite: np.ndarray = np.isfinite(data)
+        bscale: float = 1.0
+        bzero: float = 0.0
+        if finite.any():
+            lo: float = float(data[finite].min())
+            hi: float = float(data[finite].max())
+            bzero = (hi + lo) / 2
+            if hi > lo:
+                # -32768 is reserved for BLANK
+                bscale = (hi - lo) / (2**16 - 2)
+
+        blank: int = np.iinfo(np.int16).min
+        stored: np.ndarray = np.full(data.shape, blank, dtype=np.int16)
+        stored[finite] = np.clip(
+            np.round((data[finite] - bzero) / bscale), blank + 1, -blank - 1
+        )
+
+        # scaling keywords must be set after construction, otherwise astropy
+        # treats the integers as physical values
+        converted = fits.PrimaryHDU(stored, header)
+        converted.header["BSCALE"] = bscale
+        converted.header["BZERO"] = bzero
+        converted.header["BLANK"] = blank
+    else:
+        raise ValueError(f"Unsupported output data type: {dtype}")
+
     result: fits.HDUList = fits.HDUList()
-    result.append(fits.PrimaryHDU(cutout_image, header))
+    result.append(converted)
 
     return result
 
@@ -1,18 +1,27 @@
 
 import io
 import boto3
+from botocore.client import BaseClient
 
 
-def set_image_to_s3_cache(buffer: io.BytesIO, bucket_name: str, file_key: str, content_type: str):
+def set_image_to_s3_cache(
+    buffer: io.BytesIO,
+    bucket_name: str,
+    file_key: str,
+    content_type: str,
+    s3: BaseClient | None = None,
+):
     """
     Save an image from a BytesIO buffer to an S3 bucket as a specific file type.
 
     :param buffer: io.BytesIO object containing the image data.
     :param bucket_name: Name of the S3 bucket to upload to.
     :param file_key: The key (path) where the image should be saved in the bucket, including the file extension.
+    :param s3: S3 client, default is a new client.
     """
     # Create an S3 client
-    s3 = boto3.client('s3')
+    if s3 is None:
+        s3 = boto3.client('s3')
 
     # Make sure the buffer's pointer is at the beginning
     buffer.seek(0)
@@ -1,8 +1,37 @@
+import io
 import os
+import re
+import json
+import time
+import base64
+import threading
 import pytest
+import boto3
+import requests
 import numpy as np
-from lid_to_url import lid_to_url, css_lid_to_url
-from sbn_sis import cutout_handler, fits_to_image
+from PIL import Image
+from astropy.io import fits
+from astropy.nddata import PartialOverlapError
+from botocore.exceptions import ClientError
+import sbn_sis
+import image_encoder
+import negative_cache
+from lid import LID, InvalidLIDError
+from lid_to_url import lid_to_url, css_lid_to_url, validate_lid
+from sbn_sis import (
+    CutoutSource,
+    cutout_handler,
+    cached_cutout_handler,
+    cutout_bbox,
+    convert_dtype,
+    fits_to_image,
+)
+from image_encoder import get_encoding_options
+from bulk_lid_to_url import bulk_lid_to_url
+from cutout_index import find_cached_cutout
+import lambda_function
+from lambda_function import lambda_handler
+from load_replay import replay, synthetic_events
 
 
 @pytest.mark.parametrize(
@@ -209,3 +238,537 @@ def test_cutout_handler_no_overlap():
 
     # should not raise an exception
     im = fits_to_image(hdu)
+
+
+class FakeS3:
+    """Dictionary-backed stand-in for the boto3 S3 client."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def _missing(self, operation):
+        return ClientError(
+            {"Error": {"Code": "404", "Message": "Not Found"}}, operation
+        )
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self._missing("HeadObject")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self._missing("GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.read()
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(lambda_function, "S3_CLIENT", s3)
+
+    # clients must not be created from the default session in worker threads
+    def client(*args, **kwargs):
+        raise AssertionError("S3 client created outside of lambda_function")
+
+    monkeypatch.setattr(boto3, "client", client)
+    monkeypatch.setenv("S3_CACHE_BUCKET_NAME", "test-bucket")
+    return s3
+
+
+@pytest.fixture
+def local_frame(tmp_path, monkeypatch):
+    """A local Spacewatch-like frame with a TPV WCS and 1 arcsec pixels."""
+    rng = np.random.default_rng(26)
+    data = rng.normal(2500, 30, (300, 400)).astype(np.float32)
+    header = fits.Header()
+    header["CTYPE1"] = "RA---TAN"
+    header["CTYPE2"] = "DEC--TAN"
+    header["CRVAL1"] = 308.05
+    header["CRVAL2"] = -9.05
+    header["CRPIX1"] = 200.5
+    header["CRPIX2"] = 150.5
+    header["CD1_1"] = -1 / 3600
+    header["CD1_2"] = 0.0
+    header["CD2_1"] = 0.0
+    header["CD2_2"] = 1 / 3600
+    header["PV1_1"] = 1.0
+    header["PV1_4"] = 1e-3
+    header["PV2_1"] = 1.0
+    header["PV2_4"] = 2e-3
+
+    path = tmp_path / "sw_0996_SW403s_2003_07_08_08_40_33.007.fits"
+    fits.PrimaryHDU(data, header).writeto(path)
+    monkeypatch.setattr(sbn_sis, "lid_to_url", lambda lid: str(path))
+
+    return "urn:nasa:pds:gbo.ast.spacewatch.survey:data:" + path.name
+
+
+def cutout_event(lid, **params):
+    """API Gateway event for a cutout request near the center of `local_frame`."""
+    query = {"ra": "308.051", "dec": "-9.0495", "size": "1arcmin", "format": "fits"}
+    query.update(params)
+    return {
+        "httpMethod": "GET",
+        "resource": "/api/images/{lid}",
+        "path": f"/api/images/{lid}",
+        "queryStringParameters": query,
+        "pathParameters": {"lid": lid},
+    }
+
+
+def test_cached_cutout_handler(local_frame):
+    with CutoutSource(local_frame) as source:
+        large, bbox = source.cutout(308.05, -9.05, "2 arcmin", return_bbox=True)
+        assert bbox == (140, 259, 90, 209)
+        assert (
+            cutout_bbox(source.header, source.shape, 308.05, -9.05, "2 arcmin")
+            == bbox
+        )
+        index = {
+            "wcs": source.wcs.to_header(relax=True).tostring(),
+            "shape": source.shape,
+            "cutouts": [
+                {"key": "full", "bbox": [0, 399, 0, 299]},
+                {"key": "large", "bbox": bbox},
+            ],
+        }
+
+    # round trip through the cache
+    buffer = io.BytesIO()
+    large.writeto(buffer, output_verify="ignore")
+    buffer.seek(0)
+    cached = fits.open(buffer)
+
+    ra, dec = 308.051, -9.0495
+    assert find_cached_cutout(index, ra, dec, "30 arcsec")["key"] == "large"
+    expected = cutout_handler(local_frame, ra, dec, "30 arcsec")
+    result = cached_cutout_handler(cached, ra, dec, "30 arcsec")
+
+    assert np.all(result[0].data == expected[0].data)
+    assert result[0].header == expected[0].header
+
+    assert find_cached_cutout(index, ra, dec, "3 arcmin")["key"] == "full"
+    with pytest.raises(PartialOverlapError):
+        cached_cutout_handler(cached, ra, dec, "3 arcmin")
+
+    # requests are not trimmed to the image
+    assert find_cached_cutout(index, ra, dec, "10 arcmin") is None
+
+    # very large requests are evaluated without allocating the cutout
+    xmin, xmax, ymin, ymax = cutout_bbox(
+        fits.Header.fromstring(index["wcs"]), index["shape"], ra, dec, "100 deg"
+    )
+    assert xmin < 0 and xmax > 399 and ymin < 0 and ymax > 299
+    assert find_cached_cutout(index, ra, dec, "100 deg") is None
+
+
+def test_lambda_handler_spatial_reuse(local_frame, fake_s3, monkeypatch):
+    result = lambda_handler(cutout_event(local_frame, size="2arcmin"), None)
+    assert result["statusCode"] == 200
+    expected = lambda_handler(cutout_event(local_frame, size="30arcsec"), None)
+
+    # the source is no longer needed
+    fake_s3.objects = {
+        k: v for k, v in fake_s3.objects.items() if "30arcsec" not in k[1]
+    }
+    monkeypatch.setattr(sbn_sis, "lid_to_url", lambda lid: "/nonexistent.fits")
+    result = lambda_handler(cutout_event(local_frame, size="30arcsec"), None)
+    assert result["body"] == expected["body"]
+    assert any("30arcsec" in key for _, key in fake_s3.objects)
+
+    # not contained, falls back to the (now missing) source
+    result = lambda_handler(cutout_event(local_frame, size="3arcmin"), None)
+    assert result["statusCode"] == 404
+
+
+@pytest.mark.parametrize("dtype,bitpix", [("float32", -32), ("int16", 16)])
+def test_convert_dtype(dtype, bitpix):
+    rng = np.random.default_rng(27)
+    data = rng.normal(1000, 300, (50, 60))
+    data[3, 4] = np.nan
+    hdu = fits.HDUList([fits.PrimaryHDU(data)])
+    hdu[0].header["OBJECT"] = "test"
+
+    buffer = io.BytesIO()
+    convert_dtype(hdu, dtype).writeto(buffer)
+    nbytes = len(buffer.getvalue())
+    buffer.seek(0)
+
+    raw = fits.open(io.BytesIO(buffer.getvalue()), do_not_scale_image_data=True)
+    assert raw[0].header["BITPIX"] == bitpix
+    assert nbytes < data.nbytes / (8 // abs(bitpix // 8)) + 2 * 2880
+
+    result = fits.open(buffer)
+    assert result[0].header["OBJECT"] == "test"
+    assert np.isnan(result[0].data[3, 4])
+    assert np.isnan(result[0].data).sum() == 1
+
+    finite = np.isfinite(data)
+    error = np.abs(result[0].data[finite] - data[finite])
+    if dtype == "float32":
+        assert np.all(error <= np.abs(data[finite]) * 2**-24)
+    else:
+        # quantization error, plus rounding as astropy reads back as float32
+        limit = (np.nanmax(data) - np.nanmin(data)) / 131068
+        assert np.all(error <= limit + np.abs(data[finite]) * 2**-24)
+        assert raw[0].header["BLANK"] == -32768
+
+
+def test_convert_dtype_float32_small_source():
+    hdu = fits.HDUList([fits.PrimaryHDU(np.arange(12, dtype=np.uint16).reshape(3, 4))])
+    assert convert_dtype(hdu, "float32") is hdu
+
+
+def test_convert_dtype_no_overlap():
+    hdu = fits.HDUList([fits.PrimaryHDU(np.array([[np.nan]]))])
+    result = convert_dtype(hdu, "int16")
+    assert result[0].data[0, 0] == -32768
+
+
+@pytest.mark.parametrize(
+    "image_format,quality,effort,expected",
+    [
+        ("jpeg", None, None, {"quality": 95}),
+        ("png", None, "1", {"effort": 1}),
+        ("webp", "70", None, {"quality": 70, "effort": 2}),
+        ("fits", "70", "1", {}),
+    ],
+)
+def test_get_encoding_options(image_format, quality, effort, expected):
+    assert get_encoding_options(image_format, quality, effort) == expected
+
+
+@pytest.mark.parametrize(
+    "image_format,quality,effort",
+    [("jpeg", "100", None), ("png", None, "10"), ("webp", "high", None)],
+)
+def test_get_encoding_options_invalid(image_format, quality, effort):
+    with pytest.raises(ValueError):
+        get_encoding_options(image_format, quality, effort)
+
+
+def test_lambda_handler_webp(local_frame, fake_s3, monkeypatch):
+    # images are encoded by the shared encoder pool
+    threads = []
+    encode_image = image_encoder.encode_image
+
+    def recording_encode_image(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return encode_image(*args, **kwargs)
+
+    monkeypatch.setattr(image_encoder, "encode_image", recording_encode_image)
+
+    event = cutout_event(local_frame, format="webp")
+    result = lambda_handler(event, None)
+    assert threads[0].startswith("image-encoder")
+    assert result["statusCode"] == 200
+    assert result["headers"]["Content-Type"] == "image/webp"
+    image = Image.open(io.BytesIO(base64.b64decode(result["body"])))
+    assert image.format == "WEBP"
+    key = f"{local_frame}?ra=308.051&dec=-9.0495&size=1arcmin"
+    assert [key for _, key in fake_s3.objects] == [
+        re.sub(r"[/:?&=\.]", "_", key) + ".webp"
+    ]
+
+    # default options share the cache key, others do not
+    lambda_handler(
+        cutout_event(local_frame, format="webp", quality="85", effort="2"), None
+    )
+    assert len(fake_s3.objects) == 1
+    lambda_handler(cutout_event(local_frame, format="webp", dtype="int16"), None)
+    assert len(fake_s3.objects) == 1
+    lambda_handler(cutout_event(local_frame, format="webp", quality="60"), None)
+    assert len(fake_s3.objects) == 2
+
+    result = lambda_handler(cutout_event(local_frame, format="webp", effort="7"), None)
+    assert result["statusCode"] == 400
+
+
+@pytest.mark.parametrize(
+    "lid",
+    [
+        "urn:nasa:pds:gbo.ast.unknown.survey:data:file",
+        "urn:nasa:pds:gbo.ast.neat.survey:data_unknown:g19960417_obsdata_960417070119d",
+        "urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:bad",
+        "urn:nasa:pds",
+        "not a lid",
+    ],
+)
+def test_lid_to_url_invalid(lid):
+    with pytest.raises(InvalidLIDError):
+        lid_to_url(lid)
+
+    with pytest.raises(InvalidLIDError):
+        validate_lid(lid)
+
+
+def test_lambda_handler_negative_cache(local_frame, fake_s3, monkeypatch):
+    # count upstream requests
+    upstream = []
+    url = sbn_sis.lid_to_url(local_frame)
+
+    def counting_lid_to_url(lid):
+        upstream.append(str(lid))
+        return url if str(lid) == local_frame else url + ".missing"
+
+    monkeypatch.setattr(sbn_sis, "lid_to_url", counting_lid_to_url)
+
+    # upstream 404
+    missing = local_frame.replace("007", "008")
+    for _ in range(2):
+        result = lambda_handler(cutout_event(missing), None)
+        assert result["statusCode"] == 404
+        result = lambda_handler(cutout_event(missing, size="2arcmin"), None)
+        assert result["statusCode"] == 404
+    assert upstream == [missing]
+
+    # invalid LIDs are rejected without S3 requests, so nothing is stored
+    monkeypatch.setattr(lambda_function, "S3_CLIENT", None)
+    for invalid in [
+        "urn:nasa:pds:gbo.ast.unknown.survey:data:file",
+        "urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:bad",
+        "not a lid",
+    ]:
+        assert lambda_handler(cutout_event(invalid), None)["statusCode"] == 400
+    monkeypatch.setattr(lambda_function, "S3_CLIENT", fake_s3)
+    assert upstream == [missing]
+
+    # no overlap, stored cutout is served in any format
+    upstream.clear()
+    expected = lambda_handler(cutout_event(local_frame, ra="310"), None)
+    assert expected["statusCode"] == 200
+    fake_s3.objects = {
+        k: v for k, v in fake_s3.objects.items() if k[1].endswith(".json")
+    }
+    assert lambda_handler(cutout_event(local_frame, ra="310"), None) == expected
+    result = lambda_handler(cutout_event(local_frame, ra="310", format="png"), None)
+    assert result["statusCode"] == 200
+    assert upstream == [local_frame]
+
+    # expired entries are ignored
+    now = negative_cache.time.time()
+    monkeypatch.setattr(negative_cache.time, "time", lambda: now + 3601)
+    result = lambda_handler(cutout_event(missing, size="3arcmin"), None)
+    assert result["statusCode"] == 404
+    assert upstream == [local_frame, missing]
+
+
+def test_load_replay():
+    events = synthetic_events(
+        8, 0.5, {"fits": 1, "webp": 1}, {"1arcmin": 1}, frames=2, shape=256
+    )
+    report = replay(events, concurrency=2, frame_shape=256)
+
+    assert report["requests"] == 8
+    assert report["errors"] == 0
+    assert report["upstream_bytes"] > 0
+    assert len(report["max_rss"]) <= 2
+    assert report["latency"]["p50"] <= report["latency"]["p99"]
+
+
+def test_lid_parsed_once():
+    lid = LID("urn:nasa:pds:gbo.ast.neat.survey:data_geodss:g19960417_obsdata_960417")
+    assert LID(lid) is lid
+    assert lid.bundle == "gbo.ast.neat.survey"
+    assert lid.collection == "data_geodss"
+    assert lid.product_id == "g19960417_obsdata_960417"
+    with pytest.raises(AttributeError):
+        lid.survey = "NEAT"
+
+
+def test_bulk_lid_to_url(monkeypatch):
+    monkeypatch.setenv("S3_CSS_DATE_LIMIT", "20230526")
+
+    # S3 availability checks
+    checked = []
+
+    def head(self, url, **kwargs):
+        checked.append(url)
+        response = requests.Response()
+        response.status_code = 404 if "TEST" in url else 200
+        return response
+
+    monkeypatch.setattr(requests.Session, "head", head)
+
+    lids = [
+        "urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:"
+        "g96_20230526_2b_fa44c2_01_0003.arch",
+        "urn:nasa:pds:gbo.ast.unknown.survey:data:file",
+        "urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:"
+        "g96_20230526_2b_fa44c2_01_test.arch",
+        "urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:"
+        "g96_20230527_2b_fa44c2_01_0003.arch",
+        "urn:nasa:pds:gbo.ast.spacewatch.survey:data:"
+        "sw_0993_09.01_2003_03_23_09_18_47.001.fits",
+        "not a lid",
+        "urn:nasa:pds:gbo.ast.loneos.survey:data_augmented:051113_1a_011_fits",
+        "urn:nasa:pds:gbo.ast.neat.survey:data_unknown:g19960417_obsdata_960417",
+    ]
+    results = bulk_lid_to_url(lids)
+
+    assert [result["lid"] for result in results] == lids
+    assert [("error" in result) for result in results] == [
+        False,
+        True,
+        False,
+        False,
+        False,
+        True,
+        False,
+        True,
+    ]
+    assert len(checked) == 2
+
+    expected = [
+        "https://pds-css-archive.s3.us-west-2.amazonaws.com/sbn/gbo.ast.catalina.survey/"
+        "data_calibrated/G96/2023/23May26/G96_20230526_2B_FA44C2_01_0003.arch.fz",
+        "https://sbnarchive.psi.edu/pds4/surveys/gbo.ast.catalina.survey/"
+        "data_calibrated/G96/2023/23May26/G96_20230526_2B_FA44C2_01_TEST.arch.fz",
+        "https://sbnarchive.psi.edu/pds4/surveys/gbo.ast.catalina.survey/"
+        "data_calibrated/G96/2023/23May27/G96_20230527_2B_FA44C2_01_0003.arch.fz",
+        lid_to_url(lids[4]),
+        lid_to_url(lids[6]),
+    ]
+    assert [result["url"] for result in results if "url" in result] == expected
+
+    assert results[6]["bundle"] == "gbo.ast.loneos.survey"
+    assert results[6]["collection"] == "data_augmented"
+    assert results[6]["product_id"] == "051113_1a_011_fits"
+
+
+def test_bulk_lid_to_url_timeout(monkeypatch):
+    monkeypatch.setenv("S3_CSS_DATE_LIMIT", "20230526")
+
+    # the check of one file does not respond
+    release = threading.Event()
+
+    def head(self, url, **kwargs):
+        if "0002" in url:
+            release.wait(10)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(requests.Session, "head", head)
+
+    lids = [
+        "urn:nasa:pds:gbo.ast.catalina.survey:data_calibrated:"
+        f"g96_20230526_2b_fa44c2_01_{i:04d}.arch"
+        for i in range(1, 4)
+    ]
+    start = time.monotonic()
+    results = bulk_lid_to_url(lids, timeout=0.5)
+    release.set()
+    assert time.monotonic() - start < 5
+
+    psi = [result["url"].startswith("https://sbnarchive.psi.edu") for result in results]
+    assert psi == [False, True, False]
+
+
+def test_lambda_handler_urls(monkeypatch):
+    monkeypatch.setenv("S3_CSS_DATE_LIMIT", "00000000")
+    lids = [
+        "urn:nasa:pds:gbo.ast.loneos.survey:data_augmented:051113_1a_011_fits",
+        "urn:nasa:pds:gbo.ast.unknown.survey:data:file",
+    ]
+    event = {
+        "httpMethod": "POST",
+        "resource": "/api/urls",
+        "path": "/api/urls",
+        "body": base64.b64encode(json.dumps({"lids": lids}).encode()).decode(),
+        "isBase64Encoded": True,
+    }
+    result = lambda_handler(event, None)
+    assert result["statusCode"] == 200
+    assert result["headers"]["Content-Type"] == "application/json"
+    body = json.loads(result["body"])
+    assert body[0]["url"] == lid_to_url(lids[0])
+    assert "error" in body[1]
+
+    event = {
+        "httpMethod": "POST",
+        "resource": "/api/urls",
+        "path": "/api/urls",
+        "body": '{"lid": []}',
+    }
+    assert lambda_handler(event, None)["statusCode"] == 400
+
+    event["httpMethod"] = "GET"
+    assert lambda_handler(event, None)["statusCode"] == 405
+
+
+def test_lambda_handler_pipeline(local_frame, fake_s3, monkeypatch):
+    event = cutout_event(local_frame)
+
+    # slow URL resolution and cache writes
+    url = sbn_sis.lid_to_url(local_frame)
+
+    def slow_lid_to_url(lid):
+        time.sleep(0.5)
+        return url
+
+    monkeypatch.setattr(sbn_sis, "lid_to_url", slow_lid_to_url)
+    put_object = fake_s3.put_object
+
+    def slow_put_object(*args, **kwargs):
+        time.sleep(0.2)
+        put_object(*args, **kwargs)
+
+    monkeypatch.setattr(fake_s3, "put_object", slow_put_object)
+
+    # cache writes are complete on return
+    assert lambda_handler(event, None)["statusCode"] == 200
+    assert len(fake_s3.objects) == 2
+
+    # cache hits do not wait for the speculative source preparation
+    start = time.monotonic()
+    assert lambda_handler(event, None)["statusCode"] == 200
+    assert time.monotonic() - start < 0.4
+
+
+def test_lambda_handler_stale_speculation(local_frame, fake_s3, monkeypatch):
+    event = cutout_event(local_frame)
+    assert lambda_handler(event, None)["statusCode"] == 200
+
+    # slow cache reads, so that speculation starts during each hit, and URL
+    # resolution that hangs until released
+    def slow(method):
+        def wrapper(*args, **kwargs):
+            time.sleep(0.02)
+            return method(*args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(fake_s3, "head_object", slow(fake_s3.head_object))
+    monkeypatch.setattr(fake_s3, "get_object", slow(fake_s3.get_object))
+
+    url = sbn_sis.lid_to_url(local_frame)
+    release = threading.Event()
+    hung = []
+
+    def hung_lid_to_url(lid):
+        hung.append(lid)
+        release.wait(10)
+        return url
+
+    monkeypatch.setattr(sbn_sis, "lid_to_url", hung_lid_to_url)
+    try:
+        for _ in range(12):
+            assert lambda_handler(event, None)["statusCode"] == 200
+
+        # the speculation pool is full, but queued speculation was cancelled
+        assert 0 < len(hung) <= lambda_function.SPECULATION_POOL._max_workers
+
+        # a miss does not wait for stale speculation, nor do its cache writes
+        monkeypatch.setattr(sbn_sis, "lid_to_url", lambda lid: url)
+        start = time.monotonic()
+        result = lambda_handler(cutout_event(local_frame, size="2arcmin"), None)
+        assert result["statusCode"] == 200
+        assert time.monotonic() - start < 2
+        assert any("2arcmin" in key for _, key in fake_s3.objects)
+    finally:
+        release.set()